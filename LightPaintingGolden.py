@@ -0,0 +1,216 @@
+# Golden command stream check for PathExportTool.py. Compiles the frames of a set of fixture scenes headlessly, without a
+# machine attached, and compares the command streams with the ones stored from an earlier run. Stored streams keep their
+# hash and compile time, so a change to what the machine would draw and a change in compile speed show up together.
+#
+# Fixtures are your own .blend files, e.g. trimmed copies of real shots, in one directory. Each is compiled from its
+# frame_start to frame_end unless --frames is given. Store the streams once, then check against them after a change:
+#
+#   python LightPaintingGolden.py --blender "C:\Program Files\Blender Foundation\Blender 3.6\blender.exe" --fixtures fixtures --golden golden --update
+#   python LightPaintingGolden.py --blender "C:\Program Files\Blender Foundation\Blender 3.6\blender.exe" --fixtures fixtures --golden golden
+#
+# A frame passes if its stream hash matches, or if the lit paths it draws are all within --step-tolerance steps of the
+# golden ones. Path order, color and any other command changes are reported. The exit code is 1 if any frame fails.
+#
+# Blender runs this same script to do the capture: blender -b fixture.blend --python LightPaintingGolden.py -- --capture out.json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+
+# Runs inside Blender: register the exporter from next to this script and compile the fixture's frames into output
+def capture(output, frames):
+    import bpy
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import PathExportTool
+    PathExportTool.register()
+    scene = bpy.context.scene
+    if frames is not None:
+        scene.frame_start, scene.frame_end = frames
+    bpy.ops.lightpainting.executepainting(capture_path = output)
+
+
+# Compile a fixture in a background Blender and return the captured frames
+def captureFixture(blender, fixture, frames):
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "capture.json")
+        arguments = [blender, '-b', fixture, '--factory-startup', '--python', os.path.abspath(__file__), '--', '--capture', output]
+        if frames is not None:
+            arguments += ['--frames', "{}-{}".format(*frames)]
+        startTime = time.perf_counter()
+        result = subprocess.run(arguments, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+        if result.returncode != 0 or not os.path.exists(output):
+            print(result.stdout)
+            raise RuntimeError("Blender failed to capture {}".format(fixture))
+        with open(output) as file:
+            captured = json.load(file)
+    captured['captureTime'] = time.perf_counter() - startTime
+    return captured
+
+
+# The lit polylines a stream draws, in order, one per run of moves at the same color that isn't black. Each starts where
+# the machine was when the run began. Positions are in steps.
+def litRuns(stream):
+    runs = []
+    color = None
+    position = None
+    run = None
+    for values in stream['commands']:
+        if values[0] == 'col' and values[1:4] != color:
+            color = values[1:4]
+            run = None
+        elif values[0] == 'mov':
+            target = values[1:4]
+            if color is not None and any(color):
+                if run is None:
+                    run = [position] if position is not None else []
+                    runs.append(run)
+                run.append(target)
+            position = target
+    return [np.array(run, dtype = np.float64) for run in runs if len(run) > 1]
+
+
+# Distance in steps from each of N points to the closest point of a polyline
+def polylineDistances(points, polyline):
+    starts, ends = polyline[:-1], polyline[1:]
+    direction = ends - starts
+    t = np.clip(((points[:, None] - starts) * direction).sum(axis = -1) / np.maximum((direction * direction).sum(axis = -1), 1e-12), 0, 1)
+    return np.linalg.norm(points[:, None] - (starts + t[..., None] * direction), axis = -1).min(axis = 1)
+
+
+# Differences between two captured streams of one machine and frame that matter to what is drawn. The lit polylines
+# are compared by shape rather than move by move, since a small shift changes which moves optimizeMoves merges: each
+# point of one polyline has to be within stepTolerance steps of the other, both ways. Returns the differences found and
+# the largest deviation in steps.
+def compareStreams(expected, actual, stepTolerance):
+    problems = []
+    if expected['order'] != actual['order']:
+        index = next((i for i, (a, b) in enumerate(zip(expected['order'], actual['order'])) if a != b), min(len(expected['order']), len(actual['order'])))
+        problems.append("path order changed at position {}: {} -> {}".format(index, expected['order'][index:index + 1], actual['order'][index:index + 1]))
+
+    def commands(stream, names):
+        return [values for values in stream['commands'] if values[0] in names]
+    def others(stream):
+        return [values for values in stream['commands'] if values[0] not in ('mov', 'col')]
+
+    expectedColors, actualColors = commands(expected, ('col',)), commands(actual, ('col',))
+    if expectedColors != actualColors:
+        index = next((i for i, (a, b) in enumerate(zip(expectedColors, actualColors)) if a != b), min(len(expectedColors), len(actualColors)))
+        problems.append("color changed at col {} of {}: {} -> {}".format(index, len(expectedColors), expectedColors[index:index + 1], actualColors[index:index + 1]))
+
+    expectedOthers, actualOthers = others(expected), others(actual)
+    if expectedOthers != actualOthers:
+        index = next((i for i, (a, b) in enumerate(zip(expectedOthers, actualOthers)) if a != b), min(len(expectedOthers), len(actualOthers)))
+        problems.append("command changed at {}: {} -> {}".format(index, expectedOthers[index:index + 1], actualOthers[index:index + 1]))
+
+    expectedRuns, actualRuns = litRuns(expected), litRuns(actual)
+    deviation = 0.0
+    if len(expectedRuns) != len(actualRuns):
+        problems.append("{} lit runs -> {} lit runs".format(len(expectedRuns), len(actualRuns)))
+    else:
+        for index, (a, b) in enumerate(zip(expectedRuns, actualRuns)):
+            distances = polylineDistances(b, a)
+            runDeviation = max(float(distances.max()), float(polylineDistances(a, b).max()))
+            if runDeviation > stepTolerance and deviation <= stepTolerance:
+                worst = int(np.argmax(distances))
+                problems.append("lit run {} is {:.1f} steps off, e.g. at {}".format(index, runDeviation, b[worst].astype(int).tolist()))
+            deviation = max(deviation, runDeviation)
+    return problems, deviation
+
+
+# Compare a fixture's captured frames with its golden frames. Returns the number of failing frames.
+def checkFixture(name, golden, captured, stepTolerance):
+    failures = 0
+    goldenFrames = {frame['frame']: frame for frame in golden['frames']}
+    for frame in captured['frames']:
+        expected = goldenFrames.get(frame['frame'])
+        if expected is None:
+            print("  frame {}: no golden stream".format(frame['frame']))
+            failures += 1
+            continue
+        timing = "compiled in {:.2f}s, golden {:.2f}s ({:+.0%})".format(frame['compileTime'], expected['compileTime'], frame['compileTime'] / max(expected['compileTime'], 1e-9) - 1)
+        problems = []
+        deviation = 0
+        for machine in sorted(set(expected['machines']) | set(frame['machines'])):
+            if machine not in expected['machines'] or machine not in frame['machines']:
+                problems.append("machine {} only in one capture".format(machine))
+                continue
+            if expected['machines'][machine]['hash'] == frame['machines'][machine]['hash']:
+                continue
+            machineProblems, machineDeviation = compareStreams(expected['machines'][machine], frame['machines'][machine], stepTolerance)
+            problems += ["{}: {}".format(machine, problem) for problem in machineProblems]
+            deviation = max(deviation, machineDeviation)
+        if problems:
+            failures += 1
+            print("  frame {}: FAILED, {}".format(frame['frame'], timing))
+            for problem in problems:
+                print("    " + problem)
+        elif deviation > 0:
+            print("  frame {}: lit paths within {:.1f} steps, {}".format(frame['frame'], deviation, timing))
+        else:
+            print("  frame {}: identical, {}".format(frame['frame'], timing))
+    missing = set(goldenFrames) - {frame['frame'] for frame in captured['frames']}
+    if missing:
+        print("  frames {} were not captured".format(sorted(missing)))
+        failures += len(missing)
+    return failures
+
+
+def parseFrames(text):
+    if text is None:
+        return None
+    first, _, last = text.partition('-')
+    return int(first), int(last or first)
+
+
+def main():
+    arguments = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(description = "Golden command stream check for PathExportTool.py")
+    parser.add_argument('--blender', default = "blender", help = "Blender executable")
+    parser.add_argument('--fixtures', default = "fixtures", help = "directory of fixture .blend files")
+    parser.add_argument('--golden', default = "golden", help = "directory the golden streams are kept in, one .json per fixture")
+    parser.add_argument('--frames', help = "frame range to compile, e.g. 1-10, instead of each fixture's own")
+    parser.add_argument('--step-tolerance', type = float, default = 2.0, help = "lit paths this many steps apart still pass")
+    parser.add_argument('--update', action = 'store_true', help = "store the captured streams as the new golden streams")
+    parser.add_argument('--capture', help = argparse.SUPPRESS)
+    settings = parser.parse_args(arguments)
+    frames = parseFrames(settings.frames)
+
+    if settings.capture:
+        capture(settings.capture, frames)
+        return
+
+    fixtures = sorted(name for name in os.listdir(settings.fixtures) if name.endswith('.blend'))
+    if not fixtures:
+        print("No .blend fixtures in {}".format(settings.fixtures))
+        sys.exit(1)
+    os.makedirs(settings.golden, exist_ok = True)
+
+    failures = 0
+    for fixture in fixtures:
+        name = os.path.splitext(fixture)[0]
+        goldenPath = os.path.join(settings.golden, name + ".json")
+        captured = captureFixture(settings.blender, os.path.join(settings.fixtures, fixture), frames)
+        compileTime = sum(frame['compileTime'] for frame in captured['frames'])
+        print("{}: {} frames compiled in {:.2f}s".format(name, len(captured['frames']), compileTime))
+
+        if settings.update or not os.path.exists(goldenPath):
+            with open(goldenPath, 'w') as file:
+                json.dump(captured, file, indent = 1)
+            print("  stored golden streams in {}".format(goldenPath))
+            continue
+        with open(goldenPath) as file:
+            golden = json.load(file)
+        failures += checkFixture(name, golden, captured, settings.step_tolerance)
+
+    print("{} failing frames".format(failures) if failures else "All frames match")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,8 @@
  */
 
 int PORT_NUM = 0; //change the 0 to a 1 or 2 etc. to match Arduino port
+int OSC_LISTEN_PORT = 8000; //port_out in PathExportTool.py, or the Relay Port of an additional machine
+int OSC_REPLY_PORT = 9000; //port_in in PathExportTool.py, or the Reply Port of an additional machine
 
 import java.util.*;
 import processing.serial.*;
@@ -38,8 +40,8 @@ void setup()
   oscP5 = new OscP5(this, myProperties);
   */
 
-  oscP5 = new OscP5(this, 8000);
-  myRemoteLocation = new NetAddress("127.0.0.1", 9000);
+  oscP5 = new OscP5(this, OSC_LISTEN_PORT);
+  myRemoteLocation = new NetAddress("127.0.0.1", OSC_REPLY_PORT);
   
   printArray(Serial.list());
   String portName = Serial.list()[PORT_NUM];
@@ -0,0 +1,90 @@
+# Stand-in for LightPaintingRelay.pde and the Arduino, for running PathExportTool.py without a machine attached.
+# Receives a frame's commands over OSC like the relay, checks them against the machine state the Arduino would hold,
+# and replies /finished once the frame's fin arrives. Run one per machine, each on that machine's relay and reply ports:
+#
+#   python LightPaintingStandIn.py --listen 8000 --reply 9000
+#   python LightPaintingStandIn.py --listen 8001 --reply 9001 --name "Machine 2"
+#
+# Requires the same OSC library as PathExportTool.py: https://github.com/kivy/oscpy
+
+import argparse
+import threading
+import time
+from oscpy.server import OSCThreadServer
+from oscpy.client import OSCClient
+
+commands = []
+currentFrame = -1
+machineSize = None      # siz, in steps; the Arduino keeps it between frames
+settings = None
+replySender = None
+
+
+# Summary of a frame's commands: move count, moves outside the workspace and the range covered by lit moves, in steps
+def frameReport(frameCommands):
+    global machineSize
+    color = [0, 0, 0]
+    moves = 0
+    outside = 0
+    litLower = None
+    litUpper = None
+    for values in frameCommands:
+        if values[0] == 'siz':
+            machineSize = values[1:4]
+        elif values[0] == 'col':
+            color = values[1:4]
+        elif values[0] == 'mov':
+            moves += 1
+            position = values[1:4]
+            if machineSize is not None and any(p < 0 or p > s for p, s in zip(position, machineSize)):
+                outside += 1
+            if color != [0, 0, 0]:
+                litLower = position if litLower is None else [min(a, b) for a, b in zip(litLower, position)]
+                litUpper = position if litUpper is None else [max(a, b) for a, b in zip(litUpper, position)]
+    return "{} commands, {} moves, {} outside workspace, lit range {} - {}".format(len(frameCommands), moves, outside, litLower, litUpper)
+
+def sendFinished(frame):
+    replySender.send_message(b'/finished', [frame])
+    print("[{}] Sent finished {}".format(settings.name, frame))
+
+# Incoming commands, in the relay's format: command name followed by up to three ints
+def oscEvent(*values):
+    global commands, currentFrame
+    values = list(values)
+    commands.append(values)
+    if values[0] == 'frm':
+        currentFrame = values[1]
+    elif values[0] == 'fin':
+        frameCommands, commands = commands, []
+        print("[{}] Frame {}: {}".format(settings.name, currentFrame, frameReport(frameCommands)))
+        threading.Timer(settings.execution_time, sendFinished, args = [currentFrame]).start()
+
+
+def main():
+    global settings, replySender
+    parser = argparse.ArgumentParser(description = "Stand-in light painting relay and machine")
+    parser.add_argument('--name', default = "Stand-in")
+    parser.add_argument('--listen', type = int, default = 8000, help = "port PathExportTool.py sends commands to")
+    parser.add_argument('--reply', type = int, default = 9000, help = "port PathExportTool.py listens for /finished on")
+    parser.add_argument('--reply-ip', default = "127.0.0.1")
+    parser.add_argument('--execution-time', type = float, default = 0.0, help = "seconds to wait before replying /finished")
+    settings = parser.parse_args()
+
+    receiver = OSCThreadServer(encoding = 'utf8')
+    receiver.listen(address = '0.0.0.0', port = settings.listen, default = True)
+    receiver.bind(b'/blender/x', oscEvent)
+    replySender = OSCClient(settings.reply_ip, settings.reply)
+    replySender.send_message(b'/startup', [])
+    print("[{}] Listening on {}, replying to {}:{}".format(settings.name, settings.listen, settings.reply_ip, settings.reply))
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        receiver.stop_all()
+        receiver.terminate_server()
+        receiver.join_server()
+
+
+if __name__ == '__main__':
+    main()
@@ -67,17 +67,31 @@
 #   Ensure ip_out matches IP reported in processing output on program startup
 #   Ensure all power up, bash light, and settling times in dragonframe lighting settings are 0 seconds
 #   Ensure frame move speed is 1x jog speed for slow axes of movement.
-#   OSC from Processing to Blender will only work the first time this code is run. If the addon is reloaded, you will have to restart Blender for this direction of communication to work.
+#   The OSC server and client are started on the first execute and closed on unregister, so reloading the addon keeps OSC from Processing to Blender working.
 #   LED seems best shot around 4200K white balance
 
 import bpy
 import bmesh
+import functools
+import hashlib
+import json
 import math
+import os
+import queue
+import threading
+import time
+import traceback
+import tracemalloc
+import numpy as np
+import gpu
+from gpu_extras.batch import batch_for_shader
 from bpy.types import Panel, Operator
 from mathutils import Vector
 from oscpy.server import OSCThreadServer
 from oscpy.client import OSCClient
 
+moduleLoadTime = time.perf_counter()
+
 bl_info = {
     "name": "Light Painting Path Export Tool",
     "author": "Josh Sheldon",
@@ -90,9 +104,12 @@ ip_out = "192.YOUR.IP.ADDRESS" # **YOUR IP ADDRESS**  Not sure how to change thi
 port_in = 9000
 port_out = 8000
 buffer_size = 1024
+log_osc_commands = False # print every command as it is sent; slow for large frames
 
-osc_receiver = OSCThreadServer()
-osc_sender = OSCClient(ip_out, port_out)
+osc_receiver = None
+osc_sender = None
+commandSender = None        # background thread sending the frames' commands, see CommandSender
+osc_listen_sockets = {}     # reply port -> socket, for additional machines answering on ports other than port_in
 
 props = None
 
@@ -102,21 +119,1257 @@ cancelClicked = False
 finishReceived = False
 
 currentColor = [0, 0, 0]
-currentWorldPos = Vector([0, 0, 0])
-currentMachinePos = Vector([0, 0, 0])
+currentWorldPos = np.zeros(3, dtype = np.float32)
+currentSteps = np.zeros(3, dtype = np.int32)
 
 pathFollower = None
 followPathConstraint = None
 
-def callback(*data):
+compileJob = None           # frame compilation in progress, see startCompileJob
+compileError = None         # why compiling or sending a frame stopped the painting, reported by ExecutePainting.modal
+compileProgress = None      # (frame, fraction) of the frame being compiled, shown in the panel
+compile_time_slice = 0.02   # seconds of compilation per timer callback before yielding back to Blender
+
+# Size of a command as an OSC datagram and as the serial line the relay writes to the Arduino, in bytes
+def commandBytes(values):
+    pad = lambda n: (n + 4) // 4 * 4
+    oscBytes = pad(len(b'/blender/x')) + pad(1 + len(values)) + pad(len(values[0])) + 4 * (len(values) - 1)
+    serialValues = list(values[1:]) + [0] * (4 - len(values))
+    serialBytes = len(values[0].decode() + "," + ",".join(str(value) for value in serialValues) + "\n")
+    return oscBytes, serialBytes
+
+
+# Hardware settings the machine keeps between frames. The full configuration is sent once at the start of an execution
+# and after a forced resync; after that a frame only carries the settings that differ from what the machine has acknowledged.
+# The machine state after each frame is recorded when the frame is sent and becomes acknowledged when /finished arrives.
+class MachineSession:
+    configCommands = [b'siz', b'inv', b'spd', b'cal', b'exc', b'ext', b'yel']
+    
+    def __init__(self):
+        self.acknowledged = {}      # command -> values the machine is known to hold
+        self.acknowledgedVersion = 0
+        self.version = 0
+        self.sentStates = {}        # frame -> (version, machine state after that frame's commands)
+        self.framesSent = 0
+        self.resyncRequested = True
+        
+    def forceResync(self, reason):
+        print("Machine session resync: ", reason)
+        self.resyncRequested = True
+        
+    # Filter a frame's configuration commands down to the ones the machine doesn't already hold
+    def configChanges(self, config, rehomeInterval):
+        if rehomeInterval > 0 and self.framesSent % rehomeInterval == 0:
+            self.resyncRequested = True
+        if self.resyncRequested:
+            self.acknowledged = {}
+            self.resyncRequested = False
+        return [values for values in config if self.acknowledged.get(values[0]) != values[1:]]
+    
+    def frameSent(self, frame, commands):
+        previous = self.sentStates[max(self.sentStates)][1] if self.sentStates else self.acknowledged
+        state = dict(previous)
+        for values in commands:
+            if values[0] in self.configCommands:
+                state[values[0]] = values[1:]
+        if state != previous:
+            self.version += 1
+        self.sentStates[frame] = (self.version, state)
+        self.framesSent += 1
+        
+    def frameAcknowledged(self, frame):
+        if frame in self.sentStates and not self.resyncRequested:
+            self.acknowledgedVersion, self.acknowledged = self.sentStates[frame]
+            for sentFrame in [f for f in self.sentStates if f <= frame]:
+                del self.sentStates[sentFrame]
+    
+    
+machineSession = MachineSession()
+
+
+# A machine painting the current execution. The first one is set up by the painter settings in the panel and talks to the
+# relay at ip_out/port_out; machines added under Additional Machines each have their own position, bounds and relay.
+# All machines share the remaining hardware and exposure settings. Each keeps its own session, position and path ordering.
+# region is the part of the workspace the machine owns this frame, in machine space, see partitionMachines. Machines home
+# to their origin, so keep each machine's origin out of the other machines' reach.
+class PaintingMachine:
+    def __init__(self, name, position, bounds, sender, replyPort, session):
+        self.name = name
+        self.offset = np.array(position, dtype = np.float32)
+        self.bounds = np.array(bounds, dtype = np.float32)
+        self.regionLower = np.zeros(3, dtype = np.float32)
+        self.regionUpper = self.bounds.copy()
+        self.sender = sender
+        self.replyPort = replyPort
+        self.session = session
+        self.finishedFrame = None
+        self.currentWorldPos = self.offset.copy()
+        self.currentSteps = np.zeros(3, dtype = np.int32)
+        self.previousOrdering = None    # tour of the last compiled frame and mean link length of the last nearest
+        self.referenceLinkLength = None # neighbour tour, for warm started ordering
+        self.replayOrdering = None      # journaled [path, direction] tour to repeat instead, see ExecutePainting.verifyResume
+        self.frameCommands = []
+        self.frameStats = {}
+
+
+paintingMachines = []   # machines of the current execution, see buildPaintingMachines
+
+# Machines for an execution: the panel's painter, followed by the scene's additional machines
+def buildPaintingMachines(scene):
+    global paintingMachines
+    machines = [PaintingMachine("Painter", scene.painting_robot_position, scene.painting_robot_bounds, osc_sender, port_in, machineSession)]
+    for settings in scene.painting_machines:
+        listenOSC(settings.port_in)
+        machines.append(PaintingMachine(settings.name, settings.position, settings.bounds, OSCClient(settings.ip_out, settings.port_out), settings.port_in, MachineSession()))
+    paintingMachines = machines
+    return machines
+
+def sessionForPort(port):
+    for machine in paintingMachines:
+        if machine.replyPort == port:
+            return machine.session
+    return machineSession if port == port_in else None
+
+# /finished from the relay answering on port. A frame is finished once every machine has reported it.
+def callback(port, *data):
     global finishReceived
-    print("OSC server got values: {}".format(data))
+    print("OSC server got values on port {}: {}".format(port, data))
     print("Frame: ", data[0], data[0] == bpy.context.scene.frame_current - 1)
-    if data[0] == bpy.context.scene.frame_current - 1:
+    session = sessionForPort(port)
+    if session is not None:
+        session.frameAcknowledged(data[0])
+    for machine in paintingMachines:
+        if machine.replyPort == port:
+            machine.finishedFrame = data[0]
+            if shootJournal is not None:
+                shootJournal.write('finished', frame = data[0], machine = machine.name)
+    if all(machine.finishedFrame == bpy.context.scene.frame_current - 1 for machine in paintingMachines) and data[0] == bpy.context.scene.frame_current - 1:
         finishReceived = True
+        
+# The relay sends /startup when it (re)connects, which also resets the Arduino
+def startupCallback(port, *data):
+    session = sessionForPort(port)
+    if session is not None:
+        session.forceResync("relay startup on port {}".format(port))
+
+
+# Split the painted volume into one ownership region per machine, so that no two machines ever reach into the same space.
+# Machines are lined up along the axis their centres are most spread on, side by side or stacked in Z, and each owns a
+# slab along that axis, cut down to its own bounds. Neighbouring slabs are separated by clearance. Each cut lies in the
+# overlap of the two machines' reach, or in the gap between them, where it best balances the length of path segments on
+# either side; machines share speeds, so this balances predicted draw time. The cuts move from frame to frame, but every
+# machine starts a frame wherever the last one left it, so if positions are given each cut is also kept between the two
+# machines' positions, at least clearance / 2 from each. If that misses the overlap, the cut goes to the end of that
+# range nearest the overlap, and the reachable space between is reported and left unpainted. lowers, uppers, positions and segments (S x 2 x 3) are in world space. Returns the world space region
+# corners in machine order, the axis and the cut positions.
+def partitionMachines(lowers, uppers, segments, clearance, positions = None):
+    regionLowers = np.array(lowers, dtype = np.float64)
+    regionUppers = np.array(uppers, dtype = np.float64)
+    count = len(regionLowers)
+    if count < 2:
+        return regionLowers, regionUppers, None, []
+    
+    centres = (regionLowers + regionUppers) / 2
+    axis = int(np.argmax(centres.max(axis = 0) - centres.min(axis = 0)))
+    order = np.argsort(centres[:, axis], kind = 'stable')
+    
+    segments = np.asarray(segments, dtype = np.float64).reshape(-1, 2, 3)
+    lengths = np.linalg.norm(segments[:, 1] - segments[:, 0], axis = -1)
+    low = segments[:, :, axis].min(axis = 1)
+    span = np.maximum(segments[:, :, axis].max(axis = 1) - low, 1e-9)
+    total = lengths.sum()
+    
+    cuts = []
+    for rank in range(count - 1):
+        below, above = order[rank], order[rank + 1]
+        first = min(regionLowers[above, axis], regionUppers[below, axis])
+        last = max(regionLowers[above, axis], regionUppers[below, axis])
+        if cuts:
+            first = max(first, cuts[-1] + clearance)
+            last = max(last, first)
+        if positions is not None:
+            safeFirst = positions[below][axis] + clearance / 2
+            safeLast = positions[above][axis] - clearance / 2
+            if cuts:
+                safeFirst = max(safeFirst, cuts[-1] + clearance)
+            if max(first, safeFirst) <= min(last, safeLast):
+                first, last = max(first, safeFirst), min(last, safeLast)
+            elif safeFirst <= safeLast:
+                cut = safeLast if safeLast < first else safeFirst
+                dropFirst, dropLast = (cut + clearance / 2, first) if safeLast < first else (last, cut - clearance / 2)
+                if dropLast > dropFirst:
+                    print("MACHINES {} AND {} CAN'T BE CUT IN THEIR OVERLAP, {} {:.2f} TO {:.2f} IS LEFT UNPAINTED".format(below, above, "XYZ"[axis], dropFirst, dropLast))
+                first = last = cut
+            else:
+                print("MACHINES {} AND {} ARE TOO CLOSE TOGETHER TO SEPARATE".format(below, above))
+                first = last = (positions[below][axis] + positions[above][axis]) / 2
+        candidates = np.linspace(first, last, 65)
+        lengthBelow = (lengths * np.clip((candidates[:, None] - low) / span, 0.0, 1.0)).sum(axis = 1)
+        cuts.append(float(candidates[np.argmin(np.abs(lengthBelow - total * (rank + 1) / count))]))
+        
+    for rank, index in enumerate(order):
+        if rank > 0:
+            regionLowers[index, axis] = max(regionLowers[index, axis], cuts[rank - 1] + clearance / 2)
+        if rank < count - 1:
+            regionUppers[index, axis] = min(regionUppers[index, axis], cuts[rank] - clearance / 2)
+    return regionLowers, regionUppers, axis, cuts
+
+
+
+# Hash of a frame's compiled stream. Hardware settings are left out, since which of them are sent depends on what the
+# machine already held rather than on the frame; spd is kept because it also changes within a frame.
+def streamHash(commands):
+    digest = hashlib.sha1()
+    for values in commands:
+        if values[0] in MachineSession.configCommands and values[0] != b'spd':
+            continue
+        digest.update(repr(list(values)).encode())
+    return digest.hexdigest()
+
+
+# Values of all the RNA properties of a struct, such as an fcurve modifier, in a form whose repr can be hashed. Pointers
+# to datablocks are stood in for by the datablock's name, other pointers are left out and collections are expanded.
+def rnaValues(data):
+    values = []
+    for prop in data.bl_rna.properties:
+        if prop.identifier == 'rna_type':
+            continue
+        value = getattr(data, prop.identifier)
+        if prop.type == 'POINTER':
+            value = value.name_full if isinstance(value, bpy.types.ID) else None
+        elif prop.type == 'COLLECTION':
+            value = [rnaValues(item) for item in value]
+        elif isinstance(value, set):
+            value = sorted(value)
+        elif getattr(prop, 'is_array', False):
+            value = [tuple(row) if hasattr(row, '__len__') else row for row in value]
+        values.append((prop.identifier, value))
+    return values
+
+
+# Hash of everything a shoot's streams are compiled from that can be read without stepping through the frames: the
+# exporter settings, objects with their transforms, constraints and modifiers, curve and mesh geometry, shape keys,
+# keyframes, drivers and emission colors. Stable between Blender sessions, so it can be compared with a journal.
+# Inputs it doesn't see, like simulation caches or modifier settings, are caught by recompiling a frame, see
+# ExecutePainting.verifyResume.
+def computeInputFingerprint(scene):
+    digest = hashlib.sha1()
+    
+    def add(*values):
+        digest.update(repr(values).encode())
+        
+    def addArray(collection, attribute, size):
+        values = np.empty(len(collection) * size, dtype = np.float32)
+        collection.foreach_get(attribute, values)
+        digest.update(values.tobytes())
+        
+    def name(data):
+        return data.name_full if data is not None else None
+    
+    for prop in sorted(sceneProperties()):
+        value = getattr(scene, prop)
+        if prop == 'painting_machines':
+            value = [(machine.name, tuple(machine.position), tuple(machine.bounds)) for machine in value]
+        elif not isinstance(value, (bool, int, float, str)):
+            value = tuple(value)
+        add(prop, value)
+        
+    for obj in sorted(bpy.data.objects, key = lambda o: o.name_full):
+        add(obj.name_full, obj.type, name(obj.data), name(obj.parent), [tuple(row) for row in obj.matrix_basis], obj.hide_viewport)
+        for constraint in obj.constraints:
+            add(constraint.type, constraint.mute, constraint.influence, name(getattr(constraint, 'target', None)), getattr(constraint, 'subtarget', None))
+        for modifier in obj.modifiers:
+            add(modifier.type, modifier.show_viewport, name(getattr(modifier, 'object', None)), tuple(getattr(modifier, 'vertex_indices', ())))
+        if obj.animation_data is not None:
+            add(name(obj.animation_data.action), [(driver.data_path, driver.array_index, driver.driver.expression) for driver in obj.animation_data.drivers])
+            
+    for curve in sorted(bpy.data.curves, key = lambda c: c.name_full):
+        add(curve.name_full, curve.bevel_factor_start, curve.bevel_factor_end, name(curve.bevel_object))
+        for spline in curve.splines:
+            add(spline.type, spline.use_cyclic_u, len(spline.points), len(spline.bezier_points))
+            addArray(spline.points, 'co', 4)
+            for attribute in ('co', 'handle_left', 'handle_right'):
+                addArray(spline.bezier_points, attribute, 3)
+        if curve.animation_data is not None:
+            add(name(curve.animation_data.action))
+            
+    for mesh in sorted(bpy.data.meshes, key = lambda m: m.name_full):
+        add(mesh.name_full, len(mesh.vertices))
+        addArray(mesh.vertices, 'co', 3)
+        
+    for key in sorted(bpy.data.shape_keys, key = lambda k: k.name_full):
+        for block in key.key_blocks:
+            add(key.name_full, block.name, block.value, block.mute)
+            addArray(block.data, 'co', 3)
+        if key.animation_data is not None:
+            add(name(key.animation_data.action))
+            
+    for action in sorted(bpy.data.actions, key = lambda a: a.name_full):
+        for fcurve in action.fcurves:
+            add(action.name_full, fcurve.data_path, fcurve.array_index, fcurve.mute, [point.interpolation for point in fcurve.keyframe_points])
+            for attribute in ('co', 'handle_left', 'handle_right'):
+                addArray(fcurve.keyframe_points, attribute, 2)
+                
+    for material in sorted(bpy.data.materials, key = lambda m: m.name_full):
+        colorInput = PathColorTable.getEmissionInput(material)
+        add(material.name_full, tuple(colorInput.default_value) if colorInput is not None else None)
+        animation = material.node_tree.animation_data if material.node_tree is not None else None
+        if animation is not None:
+            add(name(animation.action), [(driver.data_path, driver.driver.expression) for driver in animation.drivers])
+    return digest.hexdigest()
+
+
+# Append-only record of a shoot, kept next to the .blend file so that an execution can be resumed after a crash or a
+# relay disconnect. One JSON object per line, each flushed and fsynced as it is written:
+#   start       an execution started: first frame, last frame, machines and input fingerprint
+#   sent        a frame was sent: per machine stream hash, command count, predicted time and end position,
+#               plus compile and send times
+#   finished    a machine reported a frame finished
+# /finished arrives on the OSC server thread, so writes are serialised with a lock.
+class ShootJournal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        
+    @staticmethod
+    def pathForBlend():
+        if bpy.data.filepath:
+            directory, fileName = os.path.split(bpy.data.filepath)
+        else:
+            directory, fileName = bpy.app.tempdir, "untitled.blend"
+        return os.path.join(directory, os.path.splitext(fileName)[0] + ".lightpainting.jsonl")
+    
+    def write(self, event, **values):
+        line = (json.dumps(dict(event = event, time = time.time(), **values)) + "\n").encode()
+        with self.lock:
+            with open(self.path, 'a+b') as journalFile:
+                # Start on a new line if a crash cut the last record short
+                if journalFile.tell() > 0:
+                    journalFile.seek(-1, os.SEEK_END)
+                    if journalFile.read(1) != b'\n':
+                        line = b'\n' + line
+                journalFile.write(line)
+                journalFile.flush()
+                os.fsync(journalFile.fileno())
+                
+    # Records of a journal, leaving out a line cut short by a crash
+    def read(self):
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path) as journalFile:
+            for line in journalFile:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    print("Skipping unreadable journal line: ", line.strip())
+        return records
+    
+    # State of the latest shoot: its first start record, the last sent record of each frame, and the frames every
+    # machine they were sent to has finished
+    def shootState(self):
+        shootStart = None
+        sent = {}
+        finished = {}
+        for record in self.read():
+            if record['event'] == 'start':
+                if not record.get('resumed') or shootStart is None:
+                    shootStart = record
+                    if not record.get('resumed'):
+                        sent = {}
+                        finished = {}
+            elif record['event'] == 'sent':
+                sent[record['frame']] = record
+                finished[record['frame']] = set()
+            elif record['event'] == 'finished' and record['frame'] in finished:
+                finished[record['frame']].add(record['machine'])
+        completed = {frame for frame, record in sent.items() if set(record['machines']) <= finished[frame]}
+        return shootStart, sent, completed
+    
+    
+shootJournal = None     # journal of the current or last execution; /finished of the last frame arrives after it ends
+
+
+# Sampled light path for the current frame, held in contiguous arrays instead of one Vector per point.
+#   world:  N x 3 float32 world positions
+#   steps:  N x 3 int32 machine positions in steps
+#   flags:  N uint8 per sample flags (SAMPLE_STROKE_START)
+#   color:  3 int32 path color, 0 - 255
+SAMPLE_STROKE_START = 2 # first point of a lit sub-stroke; the move to it is drawn dark
+
+class PathBuffer:
+    def __init__(self, path, direction, world, color):
+        self.path = path
+        self.direction = direction
+        self.world = np.ascontiguousarray(world, dtype = np.float32)
+        self.steps = np.zeros((len(self.world), 3), dtype = np.int32)
+        self.flags = np.zeros(len(self.world), dtype = np.uint8)
+        self.color = np.asarray(color, dtype = np.int32)
+
+    def __len__(self):
+        return len(self.world)
+
+    def nbytes(self):
+        return self.world.nbytes + self.steps.nbytes + self.flags.nbytes + self.color.nbytes
+
+
+# Clip N segments p0 -> p1 against axis aligned boxes lower -> upper (Liang-Barsky, vectorised over segments).
+# Returns the entry and exit parameters t0, t1 along each segment and a mask of segments that touch the box.
+def clipSegments(p0, p1, lower, upper):
+    d = p1 - p0
+    inside = (p0 >= lower) & (p0 <= upper)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ta = (lower - p0) / d
+        tb = (upper - p0) / d
+    moving = d != 0
+    tNear = np.where(moving, np.minimum(ta, tb), np.where(inside, -np.inf, np.inf))
+    tFar = np.where(moving, np.maximum(ta, tb), np.where(inside, np.inf, -np.inf))
+    t0 = np.maximum(tNear.max(axis = 1), 0.0)
+    t1 = np.minimum(tFar.min(axis = 1), 1.0)
+    return t0, t1, t0 <= t1
+
+
+# Emission colors of the light path materials for every frame of an export, resolved once up front.
+# Animated colors are evaluated from the fcurves on the Emission node's color input, so lookups don't depend on the
+# scene being at that frame. Materials shared between paths are resolved once. Colors controlled by drivers can't be
+# evaluated without setting the frame, so those are read from the node at lookup time instead.
+class PathColorTable:
+    def __init__(self, frameStart, frameEnd):
+        self.frameStart = frameStart
+        self.frameEnd = frameEnd
+        self.colors = {}        # material name -> frames x 4 float32 color, or None if the material has no emission node
+        self.drivenInputs = {}  # material name -> emission color input, for driven colors
+        self.fingerprint = None
+        
+    @staticmethod
+    def getEmissionInput(material):
+        colorInput = None
+        if material is not None and material.node_tree is not None:
+            for node in material.node_tree.nodes:
+                if (node.bl_idname == "ShaderNodeEmission"):
+                    colorInput = node.inputs[0]
+        return colorInput
+    
+    @staticmethod
+    def getPathMaterial(path):
+        if len(path.material_slots) == 0:
+            return None
+        return path.material_slots[0].material
+    
+    # Description of everything the table depends on, used to decide whether a previous table can be reused
+    @staticmethod
+    def computeFingerprint(materials, frameStart, frameEnd):
+        digest = hashlib.sha1()
+        
+        def add(*values):
+            digest.update(repr(values).encode())
+            
+        add(frameStart, frameEnd)
+        for material in sorted(materials, key = lambda m: m.name_full):
+            colorInput = PathColorTable.getEmissionInput(material)
+            add(material.name_full, tuple(colorInput.default_value) if colorInput is not None else None)
+            animation = material.node_tree.animation_data if material.node_tree is not None else None
+            if animation is not None and animation.action is not None:
+                for fcurve in animation.action.fcurves:
+                    add(fcurve.data_path, fcurve.array_index, fcurve.mute, fcurve.extrapolation, [rnaValues(modifier) for modifier in fcurve.modifiers])
+                    add([(tuple(point.co), tuple(point.handle_left), tuple(point.handle_right), point.interpolation, point.easing, point.back, point.amplitude, point.period) for point in fcurve.keyframe_points])
+            if animation is not None:
+                add(tuple(driver.data_path for driver in animation.drivers))
+        return digest.hexdigest()
+        
+    def addMaterial(self, material):
+        name = material.name_full
+        if name in self.colors or name in self.drivenInputs:
+            return
+        colorInput = self.getEmissionInput(material)
+        if colorInput is None:
+            self.colors[name] = None
+            return
+        
+        frames = np.arange(self.frameStart, self.frameEnd + 1, dtype = np.float32)
+        table = np.empty((len(frames), 4), dtype = np.float32)
+        table[:] = tuple(colorInput.default_value)
+        
+        dataPath = colorInput.path_from_id("default_value")
+        animation = material.node_tree.animation_data
+        if animation is not None:
+            if any(driver.data_path == dataPath for driver in animation.drivers):
+                self.drivenInputs[name] = colorInput
+                return
+            if animation.action is not None:
+                for fcurve in animation.action.fcurves:
+                    if fcurve.data_path == dataPath and fcurve.array_index < 4:
+                        table[:, fcurve.array_index] = [fcurve.evaluate(frame) for frame in frames]
+        self.colors[name] = table
+    
+    @classmethod
+    def build(cls, paths, frameStart, frameEnd):
+        table = cls(frameStart, frameEnd)
+        materials = {material.name_full: material for material in (cls.getPathMaterial(path) for path in paths) if material is not None}
+        for material in materials.values():
+            table.addMaterial(material)
+        table.fingerprint = cls.computeFingerprint(materials.values(), frameStart, frameEnd)
+        print("Built color table: ", len(table.colors), " materials, ", len(table.drivenInputs), " driven, frames ", frameStart, " - ", frameEnd)
+        return table
+    
+    # Reuse a previous table (e.g. from an earlier or precompiled run) if nothing it depends on has changed
+    @classmethod
+    def buildOrReuse(cls, previous, paths, frameStart, frameEnd):
+        if previous is not None:
+            materials = {material.name_full: material for material in (cls.getPathMaterial(path) for path in paths) if material is not None}
+            if previous.fingerprint == cls.computeFingerprint(materials.values(), frameStart, frameEnd):
+                print("Reusing color table")
+                return previous
+        return cls.build(paths, frameStart, frameEnd)
+    
+    # Color (RGBA, 0 - 1) of a path at a frame and whether it is black. Color is None if the material has no emission node.
+    def lookup(self, path, frame):
+        material = self.getPathMaterial(path)
+        if material is None:
+            return None, True
+        name = material.name_full
+        if name not in self.colors and name not in self.drivenInputs:
+            self.addMaterial(material)
+        
+        if name in self.drivenInputs or not (self.frameStart <= frame <= self.frameEnd):
+            colorInput = self.drivenInputs.get(name) or self.getEmissionInput(material)
+            color = tuple(colorInput.default_value) if colorInput is not None else None
+        else:
+            table = self.colors[name]
+            color = None if table is None else tuple(table[frame - self.frameStart].tolist())
+            
+        isBlack = color is None or (color[0] <= 0 and color[1] <= 0 and color[2] <= 0)
+        return color, isBlack
+    
+    
+pathColorTable = None
+
+
+# Samples of one whole light path at its traversal offsets, see PathSweepCache
+class PathSweep:
+    def __init__(self, traverseIncrement):
+        self.traverseIncrement = traverseIncrement
+        self.directions = set()     # traversal directions whose offsets have been sampled
+        self.offsets = np.empty(0, dtype = np.float64)
+        self.world = np.empty((0, 3), dtype = np.float32)
+
+    def add(self, direction, offsets, world):
+        self.directions.add(direction)
+        offsets = np.concatenate([self.offsets, offsets])
+        world = np.concatenate([self.world, world])
+        self.offsets, unique = np.unique(offsets, return_index = True)
+        self.world = world[unique]
+
+    # Which of the given offsets have been sampled
+    def contains(self, offsets):
+        return np.isin(np.asarray(offsets, dtype = np.float64), self.offsets)
+    
+    # World positions at the given offsets, which must have been sampled
+    def positions(self, offsets):
+        return self.world[np.searchsorted(self.offsets, np.asarray(offsets, dtype = np.float64))]
+
+
+# Whole-path samples of light paths whose geometry doesn't change from frame to frame, for strokes that draw on or
+# erase by animating only bevel_factor_start/end. A path's geometry is fingerprinted every frame; once it is the same
+# as on the frame before, the path is sampled over its full length once and later frames take their samples from that
+# sweep, until the fingerprint changes. Follow Path offsets are already arc length parameters of Blender's path, so
+# the sweep is kept by offset.
+class PathSweepCache:
+    def __init__(self):
+        self.fingerprints = {}      # path name -> (frame, geometry fingerprint, whether it matched the previous one)
+        self.sweeps = {}            # path name -> PathSweep
+        self.evaluationsSaved = 0
+
+    # Hash of what the positions along a path depend on: its transform, curve settings, control points, shape key
+    # values and hook targets. None if the path has other modifiers, whose effect can't be seen without evaluating it.
+    @staticmethod
+    def computeFingerprint(path):
+        digest = hashlib.sha1()
+
+        def add(*values):
+            digest.update(repr(values).encode())
+
+        def addArray(collection, attribute, size):
+            values = np.empty(len(collection) * size, dtype = np.float32)
+            collection.foreach_get(attribute, values)
+            digest.update(values.tobytes())
+
+        curve = path.data
+        add([tuple(row) for row in path.matrix_world], curve.resolution_u, curve.use_path)
+        for spline in curve.splines:
+            add(spline.type, spline.use_cyclic_u, spline.use_endpoint_u, spline.use_bezier_u, spline.order_u, spline.resolution_u, len(spline.points), len(spline.bezier_points))
+            addArray(spline.points, 'co', 4)
+            for attribute in ('co', 'handle_left', 'handle_right'):
+                addArray(spline.bezier_points, attribute, 3)
+        if curve.shape_keys is not None:
+            add([(block.name, block.value, block.mute) for block in curve.shape_keys.key_blocks])
+        for modifier in path.modifiers:
+            if modifier.type != 'HOOK':
+                return None
+            target = modifier.object
+            targetMatrix = None
+            if target is not None:
+                targetMatrix = target.matrix_world
+                if target.type == 'ARMATURE' and modifier.subtarget in target.pose.bones:
+                    targetMatrix = targetMatrix @ target.pose.bones[modifier.subtarget].matrix
+                targetMatrix = [tuple(row) for row in targetMatrix]
+            add(modifier.show_viewport, modifier.strength, modifier.falloff_type, modifier.falloff_radius, tuple(modifier.center), [tuple(row) for row in modifier.matrix_inverse], tuple(modifier.vertex_indices), targetMatrix)
+        return digest.hexdigest()
+
+    # Whether a path's geometry at frame is the same as on the last frame it was checked, dropping its sweep if not.
+    # The fingerprint is only computed once per frame.
+    def isStatic(self, path, frame):
+        name = path.name_full
+        checkedFrame, fingerprint, static = self.fingerprints.get(name, (None, None, False))
+        if checkedFrame != frame:
+            current = self.computeFingerprint(path)
+            static = current is not None and current == fingerprint
+            if not static:
+                self.sweeps.pop(name, None)
+            self.fingerprints[name] = (frame, current, static)
+        return static
+
+    # The sweep of a path for a traversal increment, started over if the increment changed
+    def getSweep(self, path, traverseIncrement):
+        sweep = self.sweeps.get(path.name_full)
+        if sweep is None or sweep.traverseIncrement != traverseIncrement:
+            sweep = PathSweep(traverseIncrement)
+            self.sweeps[path.name_full] = sweep
+        return sweep
+
+
+pathSweepCache = None
+
+
+# A warm started tour is kept while its dark travel is within this fraction of the nearest neighbour reference
+warm_start_quality_tolerance = 0.1
+
+
+# Greedy nearest neighbour tour over an N x 2 x 3 array of path start and end points. Starts at the highest endpoint and
+# moves on to the closest endpoint of the remaining paths. Returns the path order and the endpoint each path is entered from.
+def orderNearestNeighbour(endpoints):
+    remaining = list(range(len(endpoints)))
+    order = []
+    directions = []
+    if len(remaining) > 0:
+        first = int(np.argmax(endpoints[:, :, 2]))
+        order = [remaining.pop(first // 2)]
+        directions = [first % 2]
+    while len(remaining) > 0:
+        lastPos = endpoints[order[-1], 1 - directions[-1]]
+        distToLast = np.linalg.norm(endpoints[remaining] - lastPos, axis = -1)
+        closest = int(np.argmin(distToLast))
+        order.append(remaining.pop(closest // 2))
+        directions.append(closest % 2)
+    return order, directions
+
+
+# Dark travel between the end of each path in a tour and the start of the next
+def tourLength(endpoints, order, directions):
+    if len(order) < 2:
+        return 0.0
+    order = np.asarray(order)
+    directions = np.asarray(directions)
+    return float(np.linalg.norm(endpoints[order[1:], directions[1:]] - endpoints[order[:-1], 1 - directions[:-1]], axis = -1).sum())
+
+
+# Tour seeded with the previous frame's order and directions. previous is (keys, directions, endpoints) of the last tour,
+# in tour order. Paths that are gone are dropped; new paths and paths with an endpoint that moved further than
+# moveTolerance are put back by cheapest insertion. Paths are then flipped where entering from the other end shortens
+# the links to their neighbours. Linear in the number of paths, plus one linear pass per inserted path.
+def orderWarmStart(endpoints, keys, previous, moveTolerance):
+    previousKeys, previousDirections, previousEndpoints = previous
+    rows = {key: row for row, key in enumerate(previousKeys)}
+    previousRows = np.array([rows.get(key, -1) for key in keys], dtype = np.int64)
+    known = np.flatnonzero(previousRows >= 0)
+    drift = np.linalg.norm(endpoints[known] - previousEndpoints[previousRows[known]], axis = -1).max(axis = -1) if len(known) > 0 else np.zeros(0)
+    stayed = known[drift <= moveTolerance]
+    stayed = stayed[np.argsort(previousRows[stayed])]
+    order = stayed.tolist()
+    directions = previousDirections[previousRows[stayed]].tolist()
+    
+    for index in np.setdiff1d(np.arange(len(keys)), stayed):
+        if len(order) == 0:
+            order, directions = [int(index)], [0]
+            continue
+        tourOrder = np.array(order)
+        tourDirections = np.array(directions)
+        entries = endpoints[tourOrder, tourDirections]
+        exits = endpoints[tourOrder, 1 - tourDirections]
+        links = np.linalg.norm(entries[1:] - exits[:-1], axis = -1)
+        best = None
+        for direction in (0, 1):
+            # Cost of inserting before tour position 0 .. len(order)
+            cost = np.zeros(len(order) + 1)
+            cost[1:] += np.linalg.norm(exits - endpoints[index, direction], axis = -1)
+            cost[:-1] += np.linalg.norm(entries - endpoints[index, 1 - direction], axis = -1)
+            cost[1:-1] -= links
+            position = int(np.argmin(cost))
+            if best is None or cost[position] < best[0]:
+                best = (cost[position], position, direction)
+        order.insert(best[1], int(index))
+        directions.insert(best[1], best[2])
+    
+    # Flip alternate positions so that each flip only depends on neighbours that stay fixed
+    order = np.array(order, dtype = np.int64)
+    directions = np.array(directions, dtype = np.int64)
+    for parity in (0, 1):
+        positions = np.arange(parity, len(order), 2)
+        if len(positions) == 0:
+            continue
+        entries = endpoints[order, directions]
+        exits = endpoints[order, 1 - directions]
+        current = np.zeros(len(positions))
+        flipped = np.zeros(len(positions))
+        hasPrevious = positions > 0
+        previousExits = exits[positions[hasPrevious] - 1]
+        current[hasPrevious] += np.linalg.norm(entries[positions[hasPrevious]] - previousExits, axis = -1)
+        flipped[hasPrevious] += np.linalg.norm(exits[positions[hasPrevious]] - previousExits, axis = -1)
+        hasNext = positions < len(order) - 1
+        nextEntries = entries[positions[hasNext] + 1]
+        current[hasNext] += np.linalg.norm(exits[positions[hasNext]] - nextEntries, axis = -1)
+        flipped[hasNext] += np.linalg.norm(entries[positions[hasNext]] - nextEntries, axis = -1)
+        flip = positions[flipped < current]
+        directions[flip] = 1 - directions[flip]
+    return order.tolist(), directions.tolist()
+
+
+# Chains of light paths that form one continuous stroke, as lists of (path index, direction) in drawing order. endpoints
+# is N x 2 x 3 and colors holds each path's color, or None for paths that are never joined. Two path ends are joined when
+# they lie within tolerance of each other, the paths have the same color, and no other path end is that close, so
+# junctions where several paths meet stay seams. A closed loop of paths is opened at an arbitrary junction.
+def chainStrokes(endpoints, colors, tolerance):
+    count = len(endpoints)
+    link = np.full(2 * count, -1, dtype = np.int64)     # path end (2 * path + end) -> the path end it joins
+    if tolerance > 0 and count > 1:
+        ends = endpoints.reshape(-1, 3).astype(np.float64)
+        cells = {}
+        for end, cell in enumerate(map(tuple, np.floor(ends / tolerance).astype(np.int64).tolist())):
+            cells.setdefault(cell, []).append(end)
+        neighbours = [[] for _ in range(2 * count)]
+        for cell, members in cells.items():
+            nearby = [other for offset in np.ndindex(3, 3, 3) for other in cells.get((cell[0] + offset[0] - 1, cell[1] + offset[1] - 1, cell[2] + offset[2] - 1), [])]
+            for end in members:
+                neighbours[end] = [other for other in nearby if other // 2 != end // 2 and np.linalg.norm(ends[other] - ends[end]) <= tolerance]
+        for end, near in enumerate(neighbours):
+            if len(near) == 1 and len(neighbours[near[0]]) == 1 and colors[end // 2] is not None and colors[end // 2] == colors[near[0] // 2]:
+                link[end] = near[0]
+    
+    strokes = []
+    visited = np.zeros(count, dtype = bool)
+    for first in range(count):
+        if visited[first]:
+            continue
+        # Walk back to the start of the stroke, stopping if it closes into a loop
+        entry = 2 * first
+        while link[entry] >= 0 and link[entry] // 2 != first:
+            entry = link[entry] ^ 1
+        stroke = []
+        while True:
+            visited[entry // 2] = True
+            stroke.append((int(entry // 2), int(entry % 2)))
+            following = link[entry ^ 1]
+            if following < 0 or visited[following // 2]:
+                break
+            entry = following
+        strokes.append(stroke)
+    return strokes
+
+
+# Estimated time for the Arduino to read, parse and come to a stop for each mov, in seconds
+predicted_move_overhead = 0.002
+
+# LightPaintingRelay.pde waits this long after writing each command to the Arduino, in seconds
+relay_command_delay = 0.01
+
+
+# Keep mask for a Douglas-Peucker simplification of an N x 3 polyline. Points are dropped only if they are within
+# tolerance of the segment that replaces them. The first and last points are always kept.
+def simplifyPolyline(points, tolerance):
+    keep = np.zeros(len(points), dtype = bool)
+    keep[0] = keep[-1] = True
+    spans = [(0, len(points) - 1)]
+    while spans:
+        first, last = spans.pop()
+        if last - first < 2:
+            continue
+        a, b = points[first], points[last]
+        inner = points[first + 1:last]
+        ab = b - a
+        lengthSquared = ab.dot(ab)
+        t = np.clip((inner - a).dot(ab) / lengthSquared, 0.0, 1.0) if lengthSquared > 0 else np.zeros(len(inner))
+        distances = np.linalg.norm(inner - (a + t[:, None] * ab), axis = -1)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            spans.append((first, split))
+            spans.append((split, last))
+    return keep
+
+
+# Remove zero length moves and merge runs of consecutive moves that are collinear within tolerance steps.
+# Moves are only merged inside runs of consecutive mov commands, so color, speed and nxt checkpoints keep their
+# place in the stream. The position before the first mov of a frame is unknown, so that mov is always kept.
+def optimizeMoves(commands, tolerance):
+    optimized = []
+    position = None
+    run = []
+    
+    def flushRun():
+        if not run:
+            return
+        points = np.array(([position] if position is not None else []) + run, dtype = np.float64)
+        keep = simplifyPolyline(points, tolerance) if len(points) > 2 else np.ones(len(points), dtype = bool)
+        if position is not None:
+            keep = keep[1:]
+        optimized.extend([b'mov'] + target for target, kept in zip(run, keep) if kept)
+        del run[:]
+        
+    for values in commands:
+        if values[0] == b'mov':
+            target = list(values[1:4])
+            if target == (run[-1] if run else position):
+                continue
+            run.append(target)
+        else:
+            flushRun()
+            if optimized and optimized[-1][0] == b'mov':
+                position = optimized[-1][1:4]
+            optimized.append(values)
+    flushRun()
+    return optimized
+
+
+# Peephole pass that tracks the machine's LED color and speed through a frame's command stream. col and spd are held back
+# until a command that depends on them: mov needs both, nxt needs the color because the LED stays as it is while the machine
+# waits on an exposure change. They are then only written if they change the machine state, which drops no-op and overwritten
+# state commands and lets spd changes move past nxt. Moves that become consecutive are merged again with optimizeMoves.
+def optimizeStateCommands(commands, tolerance):
+    color = [0, 0, 0] # the Arduino turns the LED off at the end of every execution
+    speed = None
+    pendingColor = None
+    pendingSpeed = None
+    optimized = []
+    for values in commands:
+        if values[0] == b'col':
+            pendingColor = list(values[1:4])
+        elif values[0] == b'spd':
+            pendingSpeed = list(values[1:4])
+        else:
+            if values[0] in (b'mov', b'nxt') and pendingColor is not None:
+                if pendingColor != color:
+                    optimized.append([b'col'] + pendingColor)
+                    color = pendingColor
+                pendingColor = None
+            if values[0] == b'mov' and pendingSpeed is not None:
+                if pendingSpeed != speed:
+                    optimized.append([b'spd'] + pendingSpeed)
+                    speed = pendingSpeed
+                pendingSpeed = None
+            optimized.append(values)
+    return optimizeMoves(optimized, tolerance)
+
+
+# Check that an optimized command stream drives the machine through the same states as the original one. Every nxt and every
+# command other than col/spd/mov must appear in the same order, nxt with the same LED color. Every kept mov must have the same
+# target, color and speed. Every dropped mov must be zero length, or have the color and speed of the next kept mov and lie
+# within tolerance steps of the segment that replaced it. Returns None if the streams are equivalent, otherwise a description
+# of the first difference.
+def verifyStateEquivalence(original, optimized, tolerance):
+    def machineEvents(commands):
+        color = [0, 0, 0]
+        speed = None
+        events = []
+        for values in commands:
+            if values[0] == b'col':
+                color = list(values[1:4])
+            elif values[0] == b'spd':
+                speed = list(values[1:4])
+            elif values[0] == b'mov':
+                events.append((b'mov', list(values[1:4]), color, speed))
+            elif values[0] == b'nxt':
+                events.append((b'nxt', None, color, None))
+            else:
+                events.append((values[0], list(values[1:]), None, None))
+        return events
+    
+    def segmentDistance(point, a, b):
+        point, a, b = np.array(point, dtype = np.float64), np.array(a, dtype = np.float64), np.array(b, dtype = np.float64)
+        ab = b - a
+        t = min(max((point - a).dot(ab) / ab.dot(ab), 0.0), 1.0) if ab.dot(ab) > 0 else 0.0
+        return np.linalg.norm(point - (a + t * ab))
+    
+    expected = machineEvents(original)
+    actual = machineEvents(optimized)
+    position = None
+    dropped = []
+    matched = 0
+    for index, event in enumerate(expected):
+        if matched < len(actual) and event == actual[matched]:
+            for droppedEvent in dropped:
+                if droppedEvent[1] == position:
+                    continue
+                if event[0] != b'mov' or position is None or droppedEvent[2:] != event[2:]:
+                    return "dropped mov {} changes the machine state before {}".format(droppedEvent, event)
+                if segmentDistance(droppedEvent[1], position, event[1]) > tolerance + 1e-6:
+                    return "dropped mov {} is off the merged segment to {}".format(droppedEvent, event)
+            dropped = []
+            if event[0] == b'mov':
+                position = event[1]
+            matched += 1
+        elif event[0] == b'mov':
+            dropped.append(event)
+        else:
+            return "command {} at {} is missing or has a different machine state".format(event, index)
+    for droppedEvent in dropped:
+        if droppedEvent[1] != position:
+            return "trailing mov {} was dropped".format(droppedEvent)
+    if matched != len(actual):
+        return "unexpected command {}".format(actual[matched])
+    return None
+
+
+# Per move speeds for a lit polyline of N x 3 machine space points, in units per second. MultiStepper runs each move at
+# constant speed with no acceleration, the slowest axis setting the move time, so the axis speeds jump at every junction.
+# Half of each axis' jerk limit is spent on the change of direction and half on the change of speed, and the speed only
+# changes between moves as fast as the per axis acceleration allows over the move before. Speeds stay between baseSpeed,
+# which is safe for any corner, and peakSpeed, are baseSpeed at both ends of the path, and are rounded down to a ladder of
+# levelStep ratios so that small variations don't turn into spd commands.
+def planPathSpeeds(points, baseSpeed, peakSpeed, acceleration, jerk, levelStep):
+    delta = np.diff(np.asarray(points, dtype = np.float64), axis = 0)
+    if len(delta) == 0:
+        return np.zeros(0)
+    lengths = np.abs(delta).max(axis = -1)
+    axisRates = delta / np.where(lengths > 0, lengths, 1.0)[:, None]    # per axis speed as a fraction of the move speed
+    acceleration = np.asarray(acceleration, dtype = np.float64)
+    jerk = np.asarray(jerk, dtype = np.float64) / 2
+    moving = lengths > 0
+    reach = np.zeros(len(delta))    # a zero length move allows no speed change
+    with np.errstate(divide = 'ignore'):
+        reach[moving] = np.min(acceleration / np.abs(axisRates[moving]), axis = -1) * lengths[moving]
+        cornerLimits = np.min(jerk / np.abs(axisRates[1:] - axisRates[:-1]), axis = -1)
+        speedSteps = np.min(jerk / np.maximum(np.abs(axisRates[1:]), np.abs(axisRates[:-1])), axis = -1)
+    
+    speeds = np.full(len(delta), max(peakSpeed, baseSpeed))
+    speeds[:-1] = np.minimum(speeds[:-1], cornerLimits)
+    speeds[1:] = np.minimum(speeds[1:], cornerLimits)
+    speeds = np.maximum(speeds, baseSpeed).tolist()
+    
+    # Speed up no faster than the previous move allows, then slow down no faster than each move allows before the next
+    speeds[0] = baseSpeed
+    for index in range(1, len(speeds)):
+        previous = speeds[index - 1]
+        speeds[index] = min(speeds[index], previous + min(speedSteps[index - 1], reach[index - 1] / previous))
+    speeds[-1] = baseSpeed
+    for index in range(len(speeds) - 2, -1, -1):
+        following = speeds[index + 1]
+        decelerating = (following + math.sqrt(following * following + 4 * reach[index])) / 2
+        speeds[index] = min(speeds[index], following + speedSteps[index], decelerating)
+    
+    levels = np.floor(np.log(np.asarray(speeds) / baseSpeed) / math.log1p(levelStep) + 1e-9)
+    return baseSpeed * (1 + levelStep) ** np.maximum(levels, 0)
+
+
+# Predicted time for the Arduino to execute a command stream, in seconds. MultiStepper moves all axes at constant
+# speed so that they arrive together, so each move takes as long as its slowest axis plus a fixed per move overhead.
+def predictExecutionTime(commands):
+    speed = None
+    position = None
+    total = 0.0
+    for values in commands:
+        if values[0] == b'spd':
+            speed = values[1:4]
+        elif values[0] == b'mov':
+            target = values[1:4]
+            if position is not None and speed is not None:
+                total += max(abs(t - p) / max(s, 1) for t, p, s in zip(target, position, speed))
+            total += predicted_move_overhead
+            position = target
+    return total
+
+
+# Commands and predicted time saved by drawing through a seam between two paths of a stroke, instead of going dark, moving
+# to the next path's start and writing its nxt checkpoint and color. Both versions are optimized like a frame. The time
+# includes the relay's delay for every command it writes to the Arduino.
+def seamSavings(exitSteps, entrySteps, nextSteps, color, lightSpeed, darkSpeed, tolerance):
+    before = [lightSpeed, [b'col'] + color, [b'mov'] + exitSteps]
+    separate = before + [[b'col', 0, 0, 0], darkSpeed, [b'mov'] + entrySteps, lightSpeed, [b'nxt', 0, 0, 0], [b'col'] + color, [b'mov'] + nextSteps]
+    joined = before + [[b'mov'] + entrySteps, [b'mov'] + nextSteps]
+    separate = optimizeStateCommands(optimizeMoves(separate, tolerance), tolerance)
+    joined = optimizeStateCommands(optimizeMoves(joined, tolerance), tolerance)
+    commands = len(separate) - len(joined)
+    return commands, predictExecutionTime(separate) - predictExecutionTime(joined) + commands * relay_command_delay
+
+
+# Compare peak memory and live allocations of the per point Vector handling against the array buffers for one frame.
+# Positions are synthetic, so this measures exporter bookkeeping only, not depsgraph evaluation.
+# Run from the Blender Python console: PathExportTool.profileSampleBuffers()
+def profileSampleBuffers(sampleCount = 100000):
+    offset = Vector((-45/2, -45/2, 0))
+    bounds = Vector((45, 45, 20))
+    stepsPerUnit = Vector((400, 400, 400))
+    source = (np.random.default_rng(0).random((sampleCount, 3)) * (50, 50, 22) - (25, 25, 1)).astype(np.float32)
+    sourcePoints = source.tolist()
+
+    def vectorFrame():
+        commands = []
+        for x, y, z in sourcePoints:
+            pos = Vector((x, y, z)) # matrix_world.to_translation()
+            pos = Vector([pos.x, pos.y, pos.z, 1]) # getPathPosition
+            p = Vector([pos.x, pos.y, pos.z]) - offset # pointInWorkspace
+            inBounds = p.x >= 0 and p.y >= 0 and p.z >= 0 and p.x <= bounds.x and p.y <= bounds.y and p.z <= bounds.z
+            machinePos = Vector([pos.x, pos.y, pos.z]) - offset # writeMovement
+            if inBounds:
+                commands.append([b'mov', int(machinePos.x * stepsPerUnit.x), int(machinePos.y * stepsPerUnit.y), int(machinePos.z * stepsPerUnit.z)])
+        return commands
+
+    def bufferFrame():
+        world = np.empty((sampleCount, 3), dtype = np.float32)
+        world[:] = source
+        machine = world - np.array(offset, dtype = np.float32)
+        steps = (machine * np.array(stepsPerUnit, dtype = np.float64)).astype(np.int32)
+        inBounds = np.all((machine >= 0) & (machine <= np.array(bounds, dtype = np.float32)), axis = 1)
+        return steps[inBounds]
+
+    results = {}
+    for name, frame in [("Vector", vectorFrame), ("Array buffer", bufferFrame)]:
+        tracemalloc.start()
+        startTime = time.perf_counter()
+        output = frame()
+        elapsed = time.perf_counter() - startTime
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        liveAllocations = sum(stat.count for stat in snapshot.statistics('filename'))
+        results[name] = (peak, liveAllocations, elapsed)
+        print("{}: {} samples, peak {:.2f} MB, {} live allocations, {:.1f} ms".format(name, sampleCount, peak / 1e6, liveAllocations, elapsed * 1000))
+        del output
+    return results
+
+# Compile the current frame in time slices from a bpy.app.timers callback so the UI stays responsive and cancel is
+# seen between slices. The number of path evaluations per slice adapts so that each slice takes about compile_time_slice.
+# The UI can change the frame between slices, which would mix two frames into one stream, so that stops the painting.
+# Errors compiling or sending the frame are kept in compileError for the modal operator to report, like commandSender.error.
+def startCompileJob(operator):
+    global compileJob
+    compileJob = {'operator': operator, 'steps': operator.compileFrame(bpy.context), 'frame': bpy.context.scene.frame_current, 'chunkSize': 1, 'startTime': time.perf_counter(), 'slices': 0}
+    bpy.app.timers.register(runCompileJob)
+    
+def stopCompileJob():
+    global compileJob, compileProgress
+    if bpy.app.timers.is_registered(runCompileJob):
+        bpy.app.timers.unregister(runCompileJob)
+    compileJob = None
+    compileProgress = None
+    
+def runCompileJob():
+    global compileError
+    if compileJob is None:
+        return None
+    if cancelClicked:
+        print("Frame compilation canceled")
+        stopCompileJob()
+        return None
+    if bpy.context.scene.frame_current != compileJob['frame']:
+        compileError = "frame changed from {} to {} while compiling it".format(compileJob['frame'], bpy.context.scene.frame_current)
+        print("Frame compilation stopped: ", compileError)
+        stopCompileJob()
+        return None
+    
+    operator = compileJob['operator']
+    sliceStart = time.perf_counter()
+    try:
+        for _ in range(compileJob['chunkSize']):
+            next(compileJob['steps'])
+    except StopIteration:
+        operator.compileTime = time.perf_counter() - compileJob['startTime']
+        print("Compiled frame in {:.2f}s over {} slices".format(operator.compileTime, compileJob['slices'] + 1))
+        frame = compileJob['frame']
+        stopCompileJob()
+        try:
+            operator.sendCompiledFrame(bpy.context)
+        except Exception as error:
+            traceback.print_exc()
+            compileError = "frame {} failed to send: {}".format(frame, error)
+        redrawPanels()
+        return None
+    except Exception as error:
+        traceback.print_exc()
+        compileError = "frame {} failed to compile: {}".format(compileJob['frame'], error)
+        stopCompileJob()
+        return None
+    
+    # Scale the chunk toward the time slice, limiting growth so one slow evaluation can't make the UI stall
+    elapsed = max(time.perf_counter() - sliceStart, 1e-6)
+    compileJob['chunkSize'] = max(1, min(int(compileJob['chunkSize'] * compile_time_slice / elapsed), compileJob['chunkSize'] * 2))
+    compileJob['slices'] += 1
+    redrawPanels()
+    return 0.0
+    
+# Viewport preview of the light paths as colored lines, drawn by a gpu draw handler from samples cached per path. The preview
+# disables the paths' bevel objects, so Blender no longer sweeps a mesh along every curve on each depsgraph update. Each
+# curve remembers its bevel object in a custom property so that turning the preview off puts it back.
+preview_bevel_property = 'lightpainting_bevel_object'
+preview_benchmark_iterations = 10   # redraws and frame changes timed in each mode by BenchmarkPathPreview
+
+pathPreviewSegments = {}    # path name -> (E x 2 x 3 float32 world space line segments of the lit range, RGBA color)
+pathPreviewBatch = None
+pathPreviewShader = None
+pathPreviewHandler = None
+pathPreviewStale = False    # updates during execution are skipped; the whole cache is refreshed after
+
+# The light path objects, without creating the collection: this runs from handlers and unregister
+def previewPaths():
+    collection = bpy.data.collections.get('Light Paths')
+    return collection.all_objects if collection is not None else []
+
+def setPathBevels(enabled):
+    for path in previewPaths():
+        if path.type != 'CURVE':
+            continue
+        curve = path.data
+        if enabled:
+            bevelObject = bpy.data.objects.get(curve.get(preview_bevel_property, ""))
+            if bevelObject is not None:
+                curve.bevel_object = bevelObject
+            if preview_bevel_property in curve:
+                del curve[preview_bevel_property]
+        elif curve.bevel_object is not None:
+            curve[preview_bevel_property] = curve.bevel_object.name
+            curve.bevel_object = None
+
+# Line segments of a path's lit range between its bevel factors, taken from the evaluated curve's wire mesh.
+# Only meaningful while the bevel is disabled, otherwise the mesh is the swept surface.
+def samplePreviewPath(path, depsgraph):
+    evaluated = path.evaluated_get(depsgraph)
+    mesh = evaluated.to_mesh()
+    try:
+        coords = np.empty(len(mesh.vertices) * 3, dtype = np.float32)
+        mesh.vertices.foreach_get('co', coords)
+        edges = np.empty(len(mesh.edges) * 2, dtype = np.int32)
+        mesh.edges.foreach_get('vertices', edges)
+    finally:
+        evaluated.to_mesh_clear()
+    matrix = np.array([tuple(row) for row in evaluated.matrix_world], dtype = np.float32)
+    segments = (coords.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3])[edges.reshape(-1, 2)]
+    if len(segments) == 0:
+        return segments
+    
+    delta = segments[:, 1] - segments[:, 0]
+    lengths = np.maximum(np.linalg.norm(delta, axis = -1), 1e-9)
+    starts = np.cumsum(lengths) - lengths
+    pathStart, pathEnd = sorted((path.data.bevel_factor_start, path.data.bevel_factor_end))
+    t0 = np.clip((pathStart * lengths.sum() - starts) / lengths, 0, 1)[:, None]
+    t1 = np.clip((pathEnd * lengths.sum() - starts) / lengths, 0, 1)[:, None]
+    lit = (t1 > t0)[:, 0]
+    return np.stack((segments[:, 0] + t0 * delta, segments[:, 0] + t1 * delta), axis = 1)[lit]
+
+def refreshPathPreview(depsgraph, names = None):
+    global pathPreviewBatch, pathPreviewShader
+    paths = {path.name: path for path in previewPaths() if path.type == 'CURVE' and path.visible_get()}
+    if names is None or set(paths) != set(pathPreviewSegments) or not set(names) <= set(paths):
+        pathPreviewSegments.clear()
+        names = paths.keys()
+    for name in names:
+        path = paths[name]
+        if path.data.bevel_object is not None:
+            # Added while the preview was on
+            path.data[preview_bevel_property] = path.data.bevel_object.name
+            path.data.bevel_object = None
+        material = PathColorTable.getPathMaterial(path)
+        colorInput = PathColorTable.getEmissionInput(material) if material is not None else None
+        color = tuple(colorInput.default_value) if colorInput is not None else (1.0, 0.0, 1.0, 1.0)
+        pathPreviewSegments[name] = (samplePreviewPath(path, depsgraph), color)
+    
+    if pathPreviewShader is None:
+        try:
+            pathPreviewShader = gpu.shader.from_builtin('SMOOTH_COLOR')
+        except ValueError:
+            pathPreviewShader = gpu.shader.from_builtin('3D_SMOOTH_COLOR')
+    positions = [segments.reshape(-1, 3) for segments, color in pathPreviewSegments.values()]
+    colors = [np.tile(np.asarray(color, dtype = np.float32), (segments.size // 3, 1)) for segments, color in pathPreviewSegments.values()]
+    if sum(len(p) for p in positions) == 0:
+        pathPreviewBatch = None
+        return
+    pathPreviewBatch = batch_for_shader(pathPreviewShader, 'LINES', {"pos": np.concatenate(positions), "color": np.concatenate(colors)})
+
+def drawPathPreview():
+    if pathPreviewBatch is None:
+        return
+    gpu.state.depth_test_set('LESS_EQUAL')
+    gpu.state.line_width_set(2.0)
+    pathPreviewShader.bind()
+    pathPreviewBatch.draw(pathPreviewShader)
+    gpu.state.line_width_set(1.0)
+    gpu.state.depth_test_set('NONE')
+
+# Refresh the cached samples of the paths this update touched. The exporter updates the view layer for every sample, so
+# this returns straight away while a painting is executing.
+@bpy.app.handlers.persistent
+def previewDepsgraphUpdate(scene, depsgraph):
+    global pathPreviewStale
+    if not getattr(scene, 'light_path_preview', False):
+        return
+    if executingPainting:
+        pathPreviewStale = True
+        return
+    names = set()
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Material):
+            pathPreviewStale = True
+        elif isinstance(update.id, bpy.types.Object) and (update.is_updated_geometry or update.is_updated_transform):
+            names.add(update.id.original.name)
+    names &= {path.name for path in previewPaths()}
+    if pathPreviewStale or len(names) > 0:
+        refreshPathPreview(depsgraph, None if pathPreviewStale else names)
+        pathPreviewStale = False
+
+@bpy.app.handlers.persistent
+def previewFrameChange(scene, depsgraph):
+    global pathPreviewStale
+    if getattr(scene, 'light_path_preview', False):
+        pathPreviewStale = True
+        previewDepsgraphUpdate(scene, depsgraph)
+
+# Start the preview again in a file saved with it on, whose paths are still without their bevels. Also run when the
+# addon is registered, for the file that is already open.
+@bpy.app.handlers.persistent
+def previewLoadPost(*args):
+    stopPathPreview()
+    scene = bpy.context.scene
+    if scene is not None and getattr(scene, 'light_path_preview', False):
+        setPathBevels(False)
+        startPathPreview(bpy.context)
+
+def startPathPreview(context):
+    global pathPreviewHandler
+    if pathPreviewHandler is None:
+        pathPreviewHandler = bpy.types.SpaceView3D.draw_handler_add(drawPathPreview, (), 'WINDOW', 'POST_VIEW')
+    if previewDepsgraphUpdate not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(previewDepsgraphUpdate)
+    if previewFrameChange not in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.append(previewFrameChange)
+    refreshPathPreview(context.evaluated_depsgraph_get())
+    
+def stopPathPreview():
+    global pathPreviewHandler, pathPreviewBatch
+    if pathPreviewHandler is not None:
+        bpy.types.SpaceView3D.draw_handler_remove(pathPreviewHandler, 'WINDOW')
+        pathPreviewHandler = None
+    if previewDepsgraphUpdate in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(previewDepsgraphUpdate)
+    if previewFrameChange in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.remove(previewFrameChange)
+    pathPreviewSegments.clear()
+    pathPreviewBatch = None
+    
+def redrawPanels():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
 
-sock = osc_receiver.listen(address=ip_in, port=port_in, default=True)
-osc_receiver.bind(b'/finished', callback)
 
 class ExecutePainting(Operator):
     global pathFollower, finishReceived
@@ -126,9 +1379,9 @@ class ExecutePainting(Operator):
     
     lightPaths = []
     lightPathDirections = []
+    lightPathJoined = []    # True where a path continues the previous one's stroke without going dark
  
     movingToNextPath = False
-    outOfBounds = False
     overrideColor = False
     
     machineOffset = None
@@ -137,188 +1390,464 @@ class ExecutePainting(Operator):
     machineSpeedDark = None
     machineBounds = None
     
+    # float32 copies of the machine parameters for vectorised transforms. Steps per unit is float64 so that
+    # quantisation matches int(pos.x * machineStepsPerUnit.x) on the float32 positions.
+    machineOffsetArray = None
+    machineBoundsArray = None
+    machineStepsArray = None
+    
+    # Machine being compiled and its ownership region in machine space, see useMachine
+    machine = None
+    regionLowerArray = None
+    regionUpperArray = None
+    
+    # Paths are first evaluated at every Nth traversal offset; spans between these that can't reach the workspace are not sampled further
+    coarseSampleStride = 8
     
-    def sendOSC(self, address,  values):
-        print("OSC send" , address, "{}".format(values))
-        osc_sender.send_message(address, values)
+    frameStats = {}
+    frameCommands = []
+    compileTime = 0.0
+    compileFrameNumber = 0  # frame being compiled, read once when compileFrame starts
+    
+    # First frame to paint when resuming from the journal, or -1 to start at frame_start
+    resume_frame: bpy.props.IntProperty(default = -1, options = {'HIDDEN', 'SKIP_SAVE'})
+    # If set, compile all frames and write the command streams to this file instead of sending them, see captureFrames
+    capture_path: bpy.props.StringProperty(default = "", options = {'HIDDEN', 'SKIP_SAVE'})
+    
+    
+    # Accumulate a per frame statistic, reported when the frame has been sent
+    def addFrameStat(self, name, value):
+        self.frameStats[name] = self.frameStats.get(name, 0) + value
+        
+    # Commands for the current frame are collected first and sent once the frame has been compiled and optimized
+    def writeCommand(self, values):
+        self.frameCommands.append(values)
+        
+    # Hand a machine's frame to the sender thread, recording the main thread time it took and the deepest the queue got
+    def sendFrameCommands(self, machine):
+        queueStart = time.perf_counter()
+        depth = commandSender.sendFrame(machine.sender, b'/blender/x', machine.frameCommands)
+        machine.frameStats['sendQueueTime'] = time.perf_counter() - queueStart
+        machine.frameStats['maxQueueDepth'] = depth
+            
+    # Point the transforms, configuration and position tracking at a machine's workspace and ownership region
+    def useMachine(self, machine):
+        global currentSteps, currentWorldPos
+        self.machine = machine
+        self.machineOffset = Vector(machine.offset.tolist())
+        self.machineBounds = Vector(machine.bounds.tolist())
+        self.machineOffsetArray = machine.offset
+        self.machineBoundsArray = machine.bounds
+        self.regionLowerArray = machine.regionLower
+        self.regionUpperArray = machine.regionUpper
+        currentSteps = machine.currentSteps
+        currentWorldPos = machine.currentWorldPos
+        
+    # Keep the compiled frame and where it leaves the machine
+    def storeMachine(self, machine):
+        machine.currentSteps = currentSteps
+        machine.currentWorldPos = currentWorldPos
+        machine.frameCommands = self.frameCommands
+        machine.frameStats = self.frameStats
 
-    def pointInWorkspace(self, p):
-        p = Vector([p.x, p.y, p.z]) - self.machineOffset # convert to machine space
-        result = p.x >= 0 and p.y >= 0 and p.z >= 0 and p.x <= self.machineBounds.x and p.y <= self.machineBounds.y and p.z <= self.machineBounds.z
-        #print("Checking point ", p, " bounds: ", self.machineBounds, result)
-        return result
+    # Convert N x 3 world positions to machine space
+    def toMachineSpace(self, world):
+        return np.asarray(world, dtype = np.float32) - self.machineOffsetArray
     
-    def getPathPosition(self, path, alpha):
-        global pathFollower, followPathConstraint
+    # Quantise N x 3 machine space positions to steps, truncating toward zero like int()
+    def toSteps(self, machine):
+        return (machine * self.machineStepsArray).astype(np.int32)
+    
+    # Clip a sampled polyline against the machine's ownership region. Returns a path buffer holding only the parts inside the
+    # workspace, with exact entry and exit points where the polyline crosses the workspace boundary. Each lit sub-stroke
+    # starts with a SAMPLE_STROKE_START sample. The buffer is empty if the polyline never enters the workspace.
+    def clipPathBuffer(self, path, direction, world, color):
+        machine = self.toMachineSpace(world).astype(np.float64)
+        p0, p1 = machine[:-1], machine[1:]
+        t0, t1, hits = clipSegments(p0, p1, self.regionLowerArray.astype(np.float64), self.regionUpperArray.astype(np.float64))
+        
+        delta = p1 - p0
+        entries = np.where(t0[:, None] > 0, p0 + t0[:, None] * delta, p0)
+        exits = np.where(t1[:, None] < 1, p0 + t1[:, None] * delta, p1)
+        
+        # A segment continues the previous sub-stroke if the previous segment reached its end inside the workspace
+        continues = np.zeros(len(hits), dtype = bool)
+        continues[1:] = hits[:-1] & (t1[:-1] >= 1)
+        starts = hits & ~continues
         
+        # Each hit segment emits its exit point, preceded by its entry point if it starts a sub-stroke
+        counts = hits.astype(np.intp) + starts
+        slots = np.cumsum(counts) - counts
+        clipped = np.empty((int(counts.sum()), 3), dtype = np.float64)
+        flags = np.zeros(len(clipped), dtype = np.uint8)
+        clipped[slots[starts]] = entries[starts]
+        flags[slots[starts]] |= SAMPLE_STROKE_START
+        clipped[slots[hits] + starts[hits]] = exits[hits]
+        np.clip(clipped, self.regionLowerArray, self.regionUpperArray, out = clipped)
+        
+        buffer = PathBuffer(path, direction, (clipped + self.machineOffsetArray).astype(np.float32), color)
+        buffer.steps[:] = self.toSteps(clipped)
+        buffer.flags[:] = flags
+        
+        self.addFrameStat('strokeSplits', max(int(starts.sum()) - 1, 0))
+        return buffer
+    
+    def getPathRange(self, path):
         pathStart = path.data.bevel_factor_start
         pathEnd = path.data.bevel_factor_end
         if (pathEnd < pathStart):
             pathStart, pathEnd = pathEnd, pathStart
+        return pathStart, pathEnd
+    
+    def getPathPosition(self, path, alpha):
+        global pathFollower, followPathConstraint
+        
+        pathStart, pathEnd = self.getPathRange(path)
 
         followPathConstraint.target = path
         followPathConstraint.offset_factor = (pathEnd - pathStart) * alpha + pathStart #max(min(alpha, pathEnd), pathStart)
         bpy.context.view_layer.update() 
         
-        pos = pathFollower.matrix_world.to_translation()
-        return Vector([pos.x, pos.y, pos.z, 1])
+        return np.array(pathFollower.matrix_world.translation, dtype = np.float32)
+    
+    # Upper bound on the world space length of a path, or None if modifiers or shape keys can change its shape in ways
+    # the length of its splines doesn't show
+    def pathLengthBound(self, path):
+        curve = path.data
+        if len(path.modifiers) > 0 or curve.shape_keys is not None:
+            return None
+        scale = np.linalg.norm(np.array([tuple(row) for row in path.matrix_world], dtype = np.float64)[:3, :3], axis = 0).max()
+        return float(scale * sum(spline.calc_length() for spline in curve.splines))
+    
+    # Follow Path offsets of the traversal increments along a path, starting at the endpoint given by direction and
+    # ending at the first offset past alpha = 1, clamped to pathStart - pathEnd
+    def traverseOffsets(self, direction, traverseIncrement, pathStart, pathEnd):
+        offsets = [max(min(direction, pathEnd), pathStart)]
+        alpha = 0.0
+        while alpha <= 1.0:
+            alpha = alpha + traverseIncrement
+            offset = abs(direction - alpha)
+            offsets.append(max(min(offset, pathEnd), pathStart))
+        return offsets
+
+    # The sweep of a path whose geometry hasn't changed since the last frame, sampling the whole path at the traversal
+    # offsets of direction the first time they are needed. Generator that yields after every evaluation.
+    def sweepPath(self, path, direction, traverseIncrement):
+        global pathFollower, followPathConstraint
+
+        sweep = pathSweepCache.getSweep(path, traverseIncrement)
+        if direction not in sweep.directions:
+            offsets = np.setdiff1d(self.traverseOffsets(direction, traverseIncrement, 0.0, 1.0), sweep.offsets)
+            world = np.empty((len(offsets), 3), dtype = np.float32)
+            followPathConstraint.target = path
+            for index, offset in enumerate(offsets.tolist()):
+                followPathConstraint.offset_factor = offset
+                bpy.context.view_layer.update()
+                world[index] = pathFollower.matrix_world.translation
+                yield
+            sweep.add(direction, offsets, world)
+            self.addFrameStat('sweepEvaluations', len(offsets))
+        return sweep
+
+    # Evaluate a path at every traversal increment into an N x 3 float32 world position array, see traverseOffsets.
+    # Generator that yields after every evaluation, or once for a path read from its sweep, and returns the array, see compileFrame.
+    # The path is evaluated at every coarseSampleStride offsets first. Spans between coarse samples that can't reach the
+    # workspace are left out; only their coarse endpoints are kept.
+    # Paths whose geometry is unchanged since the last frame are read from their sweep instead, see PathSweepCache.
+    def samplePath(self, path, direction, traverseIncrement):
+        global props, pathFollower, followPathConstraint
+
+        pathStart, pathEnd = self.getPathRange(path)
+        offsets = self.traverseOffsets(direction, traverseIncrement, pathStart, pathEnd)
+
+        sweep = None
+        if props.reuse_path_sweeps and pathSweepCache.isStatic(path, self.compileFrameNumber):
+            sweep = yield from self.sweepPath(path, direction, traverseIncrement)
+            # A sweep read evaluates at most the ends of the drawn range, so yield once per path to keep the compile time
+            # slices honest
+            yield
+
+        world = np.empty((len(offsets), 3), dtype = np.float32)
+        followPathConstraint.target = path
+
+        # Offsets clamped to the bevel factors aren't on the sweep's grid and are always evaluated, so that a frame compiles
+        # to the same samples whatever the cache holds. Each distinct offset is evaluated once.
+        evaluated = {}
+        def evaluate(indices):
+            if sweep is not None:
+                indices = np.asarray(indices, dtype = np.intp)
+                swept = sweep.contains(np.asarray(offsets)[indices])
+                world[indices[swept]] = sweep.positions(np.asarray(offsets)[indices[swept]])
+                indices = indices[~swept].tolist()
+            for index in indices:
+                if offsets[index] not in evaluated:
+                    followPathConstraint.offset_factor = offsets[index]
+                    bpy.context.view_layer.update() 
+                    world[index] = pathFollower.matrix_world.translation
+                    evaluated[offsets[index]] = world[index].copy()
+                    yield
+                world[index] = evaluated[offsets[index]]
+        
+        coarse = list(range(0, len(offsets), self.coarseSampleStride))
+        if coarse[-1] != len(offsets) - 1:
+            coarse.append(len(offsets) - 1)
+        yield from evaluate(coarse)
+        
+        # Follow Path offsets are arc length parameters, so every point of a span is within half the span's length of
+        # one of its coarse endpoints. Spans are only skipped if their chord misses the region grown by that much.
+        # If the chords are longer than the bound says the path can be, the bound is wrong and every span is sampled.
+        coarseMachine = self.toMachineSpace(world[coarse]).astype(np.float64)
+        spanStarts, spanEnds = coarseMachine[:-1], coarseMachine[1:]
+        spanLengths = np.abs(np.diff(np.asarray(offsets)[coarse]))
+        pathLength = self.pathLengthBound(path)
+        if pathLength is None or np.linalg.norm(spanEnds - spanStarts, axis = -1).sum() > pathLength * spanLengths.sum() * 1.001 + 1e-4:
+            spanHits = np.ones(len(coarse) - 1, dtype = bool)
+        else:
+            margin = (spanLengths * pathLength / 2 + 1e-4)[:, None]
+            t0, t1, spanHits = clipSegments(spanStarts, spanEnds, self.regionLowerArray - margin, self.regionUpperArray + margin)
+        
+        keep = np.zeros(len(offsets), dtype = bool)
+        keep[coarse] = True
+        for span in np.flatnonzero(spanHits):
+            yield from evaluate(range(coarse[span] + 1, coarse[span + 1]))
+            keep[coarse[span]:coarse[span + 1]] = True
+        
+        self.addFrameStat('evaluations', len(evaluated))
+        if sweep is not None:
+            self.addFrameStat('sweepSamples', int(np.count_nonzero(sweep.contains(np.asarray(offsets)[keep]))))
+        self.addFrameStat('skippedEvaluations', int(len(keep) - keep.sum()))
+        return world[keep]
+    
+    # Indices of the samples to draw. A sample is recorded once it is at least the traversal threshold away from
+    # the last recorded sample, and the final sample is always recorded. Index 0 is prepended as the dark approach point.
+    def selectSamples(self, world, traverseThreshold):
+        points = world.tolist()
+        lastX, lastY, lastZ = points[0]
+        selected = [0]
+        for index in range(len(points) - 1):
+            x, y, z = points[index]
+            if math.sqrt((x - lastX) ** 2 + (y - lastY) ** 2 + (z - lastZ) ** 2) >= traverseThreshold:
+                selected.append(index)
+                lastX, lastY, lastZ = x, y, z
+        selected.append(len(points) - 1)
+        return np.array(selected, dtype = np.intp)
     
     def getPathColor(self, path):
-        color = None 
-        isBlack = True 
-        for node in path.material_slots[0].material.node_tree.nodes:
-            if (node.bl_idname == "ShaderNodeEmission"):
-                color = node.inputs[0].default_value
-                isBlack = color[0] <= 0 and color[1] <= 0 and color[2] <= 0 
-        return color, isBlack
+        global pathColorTable
+        return pathColorTable.lookup(path, self.compileFrameNumber)
     
-    # Collect light paths, in optimized order for movement speed
-    def collectPaths(self, context):
+    # Light paths worth evaluating this frame. The cheapest checks go first: visibility, then the material color from the
+    # color table, then the evaluated object's world space bounding box against the machine volumes. Only the paths that
+    # pass all three are evaluated through the Follow Path constraint. Their bounding boxes are kept in frameBoxes.
+    def prefilterPaths(self, paths):
         global props
         followBlackPaths = props.follow_black_paths
-        traverseThreshold = props.light_path_traverse_threshold
+        hidden = 0
+        black = 0
         
-        self.lightPaths = []            # Path objects
-        self.lightPathDirections = []   # 0 or 1 direction of path traversal
-        
-        lightPathsUnsorted = list(bpy.data.collections['Light Paths'].all_objects)
-        orderedLightPaths = []
-        orderedLightPathDirections = []
-        
-        # Filter out all light paths not in the workspace or that are black or that are too short
-        print("FILTERING OUT OF BOUNDS + BLACK + SHORT PATHS")
-        for path in reversed(lightPathsUnsorted):
-            start = self.getPathPosition(path, 0)
-            end = self.getPathPosition(path, 1)
-            mid = self.getPathPosition(path, 0.5)
+        visible = []
+        for path in paths:
+            if (not path.visible_get()):
+                print("Filtered hidden path ", path)
+                hidden += 1
+                continue
             color, isBlack = self.getPathColor(path)
-            
             if color is None:
                 print("PATH ", path, " HAS NO EMISSION NODE TO DETERMINE COLOR")
-              
-            if (not path.visible_get()):
-                lightPathsUnsorted.remove(path)
-                print("Filtered hidden path ", path)
-            elif (not self.pointInWorkspace(start) and not self.pointInWorkspace(end)):
-                lightPathsUnsorted.remove(path)
-                print("Filtered out of bounds path ", path)
-            elif (isBlack and not followBlackPaths or color is None):
-                lightPathsUnsorted.remove(path)
+            if (isBlack and not followBlackPaths or color is None):
                 print("Filtered black path ", path)
-            elif (start - end).length < 0.0001 and (start - mid).length < 0.0001:
-                lightPathsUnsorted.remove(path)
-                print("Filtered short path ", path, (start - end).length, (start - mid).length )
-            
+                black += 1
+                continue
+            visible.append(path)
+        
+        survivors = visible
+        self.frameBoxes = np.empty((0, 2, 3), dtype = np.float32)
+        if len(visible) > 0:
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            evaluated = [path.evaluated_get(depsgraph) for path in visible]
+            corners = np.array([[tuple(corner) for corner in obj.bound_box] for obj in evaluated], dtype = np.float64)
+            matrices = np.array([[tuple(row) for row in obj.matrix_world] for obj in evaluated], dtype = np.float64)
+            world = corners @ matrices[:, :3, :3].transpose(0, 2, 1) + matrices[:, None, :3, 3]
+            volumeLowers = np.array([machine.offset for machine in paintingMachines], dtype = np.float64) - 1e-3
+            volumeUppers = volumeLowers + np.array([machine.bounds for machine in paintingMachines], dtype = np.float64) + 2e-3
+            overlaps = np.all((world.min(axis = 1)[:, None] <= volumeUppers) & (world.max(axis = 1)[:, None] >= volumeLowers), axis = -1).any(axis = 1)
+            for path in np.array(visible, dtype = object)[~overlaps]:
+                print("Filtered out of bounds path ", path)
+            survivors = [path for path, overlap in zip(visible, overlaps) if overlap]
+            self.frameBoxes = np.stack([world.min(axis = 1), world.max(axis = 1)], axis = 1)[overlaps].astype(np.float32)
             
-        # Determine first light path point by max height
-        print("DETERMINING START POSITION")
-        firstEndpointPosition = None
-        firstPathIndex = 0
-        firstPathDirection = 0
+        print("Path pre-filter: {} paths, {} hidden, {} black, {} outside the machine volume, {} evaluated".format(len(paths), hidden, black, len(visible) - len(survivors), len(survivors)))
+        return survivors
+        
+    # Evaluate the start, end and mid points of the light paths that pass the pre-filter once per frame; ordering and
+    # machine partitioning work on these arrays without further depsgraph updates.
+    # Generator that yields after each path, see compileFrame.
+    def evaluatePaths(self, context):
+        global compileProgress
+        self.framePaths = self.prefilterPaths(list(getCollection('Light Paths').all_objects))
+        self.frameEndpoints = np.empty((len(self.framePaths), 2, 3), dtype = np.float32)
+        self.frameMidpoints = np.empty((len(self.framePaths), 3), dtype = np.float32)
+        for index, path in enumerate(self.framePaths):
+            self.frameEndpoints[index, 0] = self.getPathPosition(path, 0)
+            self.frameEndpoints[index, 1] = self.getPathPosition(path, 1)
+            self.frameMidpoints[index] = self.getPathPosition(path, 0.5)
+            compileProgress = (self.compileFrameNumber, 0.1 * (index + 1) / len(self.framePaths))
+            yield
+    
+    # Set the ownership region of each machine for this frame from the evaluated paths and where the machines are, see partitionMachines.
+    # Each path is stood in for by the two segments through its midpoint.
+    def partitionPaths(self, context):
+        segments = np.concatenate([np.stack([self.frameEndpoints[:, 0], self.frameMidpoints], axis = 1), np.stack([self.frameMidpoints, self.frameEndpoints[:, 1]], axis = 1)])
+        lowers = np.array([machine.offset for machine in paintingMachines])
+        uppers = lowers + np.array([machine.bounds for machine in paintingMachines])
+        positions = np.array([machine.currentWorldPos for machine in paintingMachines], dtype = np.float64)
+        regionLowers, regionUppers, axis, cuts = partitionMachines(lowers, uppers, segments, context.scene.machine_clearance, positions)
+        for machine, lower, upper in zip(paintingMachines, regionLowers, regionUppers):
+            machine.regionLower = (lower - machine.offset).astype(np.float32)
+            machine.regionUpper = (upper - machine.offset).astype(np.float32)
+        print("Machine regions split along {} at {}".format("XYZ"[axis], ", ".join("{:.2f}".format(cut) for cut in cuts)))
+        
+    # Collect the evaluated light paths in the current machine's region, in optimized order for movement speed
+    def collectPaths(self, context):
+        global props
+        traverseThreshold = props.light_path_traverse_threshold
         
+        self.lightPaths = []            # Path objects
+        self.lightPathDirections = []   # 0 or 1 direction of path traversal
+        self.lightPathJoined = []
+        
+        lightPathsUnsorted = self.framePaths
+        endpoints = self.frameEndpoints
+        midpoints = self.frameMidpoints
+        boxes = self.toMachineSpace(self.frameBoxes)
+        boxesInRegion = np.all((boxes[:, 1] >= self.regionLowerArray - 1e-3) & (boxes[:, 0] <= self.regionUpperArray + 1e-3), axis = -1)
+        startEndLengths = np.linalg.norm(endpoints[:, 0] - endpoints[:, 1], axis = -1)
+        startMidLengths = np.linalg.norm(endpoints[:, 0] - midpoints, axis = -1)
+        keep = []
+        
+        # Filter out all light paths whose bounding box misses the machine's region or that are too short. A path with both
+        # ends outside the region may still cross it, so it is kept for clipping.
+        print("FILTERING OUT OF BOUNDS + SHORT PATHS")
         for index, path in enumerate(lightPathsUnsorted):
-            for direction in [0, 1]:
-                pos = self.getPathPosition(path, direction)
-                if (firstEndpointPosition is None or pos.z > firstEndpointPosition.z):
-                    firstEndpointPosition = pos
-                    firstPathIndex = index
-                    firstPathDirection = direction
-             
-        if len(lightPathsUnsorted) > 0:           
-            orderedLightPaths = [lightPathsUnsorted.pop(firstPathIndex)]
-            orderedLightPathDirections = [firstPathDirection]
-        
-        # Get sorted list of light paths/directions in order of closest path to the last path's end point
+            if (not boxesInRegion[index]):
+                print("Filtered out of bounds path ", path)
+            elif startEndLengths[index] < 0.0001 and startMidLengths[index] < 0.0001:
+                print("Filtered short path ", path, startEndLengths[index], startMidLengths[index])
+            else:
+                keep.append(index)
+                
+        lightPathsUnsorted = [lightPathsUnsorted[index] for index in keep]
+        endpoints = endpoints[keep]
+        
+        # Join paths that continue each other in the same color into strokes, which are ordered like single paths
+        colors = [self.getPathColor(path) for path in lightPathsUnsorted]
+        strokes = chainStrokes(endpoints, [None if isBlack else tuple(int(c * 255) for c in color[:3]) for color, isBlack in colors], props.stroke_join_tolerance)
+        keys = ["+".join(lightPathsUnsorted[index].name_full for index, direction in stroke) for stroke in strokes]
+        endpoints = np.array([[endpoints[stroke[0][0], stroke[0][1]], endpoints[stroke[-1][0], 1 - stroke[-1][1]]] for stroke in strokes], dtype = np.float32).reshape(-1, 2, 3)
+        if len(strokes) < len(lightPathsUnsorted):
+            print("Joined ", len(lightPathsUnsorted), " light paths into ", len(strokes), " strokes")
+        
+        # Seed the tour with the previous frame's ordering if there is one, and reorder from scratch if it got too long.
+        # The reference is the mean link of the last nearest neighbour tour, which also bounds how far a path may move
+        # before it is reinserted.
         print("GETTING SORTED LIST OF LIGHT PATHS")
-        for n in range(len(lightPathsUnsorted)):
-            lastPath = orderedLightPaths[-1]
-            lastPos = self.getPathPosition(lastPath, 1 - orderedLightPathDirections[-1])
-    
-            closestPathIndex = None
-            pathDirection = None
-            closestDist = None
-            
-            for index, path in enumerate(lightPathsUnsorted):
-                for direction in [0, 1]:
-                    pos = self.getPathPosition(path, direction)
-                    distToLast = (pos - lastPos).length
-                    if (closestPathIndex == None or distToLast < closestDist):
-                        closestPathIndex = index
-                        pathDirection = direction
-                        closestDist = distToLast
-                        
-            orderedLightPaths.append(lightPathsUnsorted.pop(closestPathIndex))
-            orderedLightPathDirections.append(pathDirection)
+        orderingStart = time.perf_counter()
+        ordering = 'nearest'
+        machine = self.machine
+        if machine.replayOrdering is not None:
+            positions = {key: index for index, key in enumerate(keys)}
+            replayed = [(positions[key], direction) for key, direction in machine.replayOrdering if key in positions]
+            order = [index for index, direction in replayed]
+            orderedLightPathDirections = [direction for index, direction in replayed]
+            length = tourLength(endpoints, order, orderedLightPathDirections)
+            ordering = 'replay'
+        elif props.path_ordering == 'WARM_START' and machine.previousOrdering is not None and machine.referenceLinkLength is not None:
+            order, orderedLightPathDirections = orderWarmStart(endpoints, keys, machine.previousOrdering, machine.referenceLinkLength)
+            length = tourLength(endpoints, order, orderedLightPathDirections)
+            ordering = 'warm'
+            if length > machine.referenceLinkLength * max(len(order) - 1, 0) * (1 + warm_start_quality_tolerance) + 1e-6:
+                print("Warm started tour too long, reordering: ", length)
+                ordering = 'fallback'
+        if ordering in ('nearest', 'fallback'):
+            order, orderedLightPathDirections = orderNearestNeighbour(endpoints)
+            length = tourLength(endpoints, order, orderedLightPathDirections)
+            machine.referenceLinkLength = length / max(len(order) - 1, 1)
+        orderingTime = time.perf_counter() - orderingStart
+        
+        machine.previousOrdering = ([keys[index] for index in order], np.array(orderedLightPathDirections, dtype = np.int64), endpoints[order])
+        self.frameStats['pathOrdering'] = ordering
+        self.addFrameStat('tourLength', length)
+        self.addFrameStat('orderingTime', orderingTime)
+        if props.compare_path_ordering and ordering == 'warm':
+            coldStart = time.perf_counter()
+            coldOrder, coldDirections = orderNearestNeighbour(endpoints)
+            self.addFrameStat('coldOrderingTime', time.perf_counter() - coldStart)
+            self.addFrameStat('coldTourLength', tourLength(endpoints, coldOrder, coldDirections))
             
-        self.lightPaths = orderedLightPaths
-        self.lightPathDirections = orderedLightPathDirections
+        for index, direction in zip(order, orderedLightPathDirections):
+            stroke = strokes[index] if direction == 0 else [(path, 1 - pathDirection) for path, pathDirection in reversed(strokes[index])]
+            for position, (path, pathDirection) in enumerate(stroke):
+                self.lightPaths.append(lightPathsUnsorted[path])
+                self.lightPathDirections.append(pathDirection)
+                self.lightPathJoined.append(position > 0)
         
         print("Ordered light paths: ", self.lightPaths)
         print("Light path directions: ", self.lightPathDirections)
         
-    def writePosition(self, pos):
-        x, y, z = int(pos.x * self.machineStepsPerUnit.x), int(pos.y * self.machineStepsPerUnit.y), int(pos.z * self.machineStepsPerUnit.z)
-        self.sendOSC(b'/blender/x', [b'mov', x, y, z])
-    
-    def writeMovement(self, pos, doWriteNextPath):
-        global currentMachinePos, currentWorldPos, currentColor, isFirstMove
+    def writeSteps(self, x, y, z):
+        self.writeCommand([b'mov', int(x), int(y), int(z)])
+        
+    # Write the move to sample index of a path buffer
+    def writeMovement(self, buffer, index, doWriteNextPath):
+        global currentSteps, currentWorldPos, currentColor, isFirstMove
         
-        worldPos = pos
-        machinePos = pos - self.machineOffset
+        worldPos = buffer.world[index]
+        steps = buffer.steps[index]
+        propInTheWay = False
         
-        if (not self.pointInWorkspace(worldPos)):
-            if (not self.outOfBounds):
-                print("PATH LEFT MACHINE BOUNDS")
-                self.outOfBounds = True
-                self.setColorOverride(True)
+        # iterate through scene props group and raycast for collisions 
+        for prop in getCollection('Scene Props').all_objects:
+            inverse = prop.matrix_world.inverted()
+            origin = inverse @ Vector(currentWorldPos.tolist())
+            dest = inverse @ Vector(worldPos.tolist())
+            direction = (dest - origin).normalized()
+            distance = (dest - origin).length 
+            hit, loc, norm, face = prop.ray_cast(origin, direction, distance)
+        
+            if (hit):
+                propInTheWay = True
+                break
+        
+        if propInTheWay:
+            print("PROP IN THE WAY! ", self.movingToNextPath)
+        
+        # If first move or there is prop in the way and moving to a new path then avoid obstacle
+        if (self.movingToNextPath and propInTheWay or isFirstMove):
+            zHeight = self.retractHeight()
+            #if (self.machineAxisInversions[2]):
+            #    zHeight = self.machineBounds.z
+            #else:
+            #    zHeight = 0
+            zSteps = int(zHeight * self.machineStepsPerUnit.z)
                 
-            return False
-        else:
-            propInTheWay = False
-            
-            # iterate through scene props group and raycast for collisions 
-            for prop in bpy.data.collections['Scene Props'].all_objects:
-                origin = prop.matrix_world.inverted() * currentWorldPos
-                dest = prop.matrix_world.inverted() * worldPos
-                direction = (dest - origin).normalized()
-                distance = (dest - origin).length 
-                hit, loc, norm, face = prop.ray_cast(origin, direction, distance)
-            
-                if (hit):
-                    propInTheWay = True
-                    break
-            
-            if propInTheWay:
-                print("PROP IN THE WAY! ", self.movingToNextPath)
+            self.writeSteps(currentSteps[0], currentSteps[1], zSteps)
+            self.writeSteps(steps[0], steps[1], zSteps)
+            isFirstMove = False
             
-            # If first move or there is prop in the way and moving to a new path then avoid obstacle
-            if (self.movingToNextPath and propInTheWay or isFirstMove):
-                zHeight = max(min(self.propHeightLimit, self.machineBounds.z), 0)
-                #if (self.machineAxisInversions[2]):
-                #    zHeight = self.machineBounds.z
-                #else:
-                #    zHeight = 0
-                    
-                self.writePosition(Vector([currentMachinePos.x, currentMachinePos.y, zHeight]))
-                self.writePosition(Vector([machinePos.x, machinePos.y, zHeight]))
-                isFirstMove = False
-                
-            if doWriteNextPath:
-                # NextPath signals are checkpoints at the start of each path that
-                # arduino uses to know when to break up light paths across the multiple exposures
-                self.writeNextPath()
-                self.writeColor(currentColor[0], currentColor[1], currentColor[2])
-                   
-            self.writePosition(machinePos)
-            currentWorldPos = worldPos
-            currentMachinePos = machinePos
+        if doWriteNextPath:
+            # NextPath signals are checkpoints at the start of each path that
+            # arduino uses to know when to break up light paths across the multiple exposures
+            self.writeNextPath()
+            self.writeColor(currentColor[0], currentColor[1], currentColor[2])
+               
+        self.writeSteps(steps[0], steps[1], steps[2])
+        currentWorldPos = worldPos
+        currentSteps = steps
             
-            if (self.outOfBounds):
-                self.outOfBounds = False
-                self.setColorOverride(False)
-                
-            return True
             
+    # Z height to retract to for obstacle avoidance, kept inside the machine's ownership region
+    def retractHeight(self):
+        return max(min(self.propHeightLimit, float(self.regionUpperArray[2])), float(self.regionLowerArray[2]))
             
     def writeColor(self, r, g , b):
         global currentColor
@@ -327,65 +1856,113 @@ class ExecutePainting(Operator):
         b = int(b)
         currentColor = [r, g, b]
         if (not self.overrideColor):
-            self.sendOSC(b'/blender/x', [b'col', r, g, b])
+            self.writeCommand([b'col', r, g, b])
         
     def setColorOverride(self, override):
         global currentColor
         self.overrideColor = override
         if (override):
-            self.sendOSC(b'/blender/x', [b'col', 0, 0, 0])
+            self.writeCommand([b'col', 0, 0, 0])
         else:
             self.writeColor(currentColor[0], currentColor[1] , currentColor[2])
       
     def writeSpeed(self):
-        # steps per second
-        sx, sy, sz = int(self.machineSpeed * self.machineStepsPerUnit.x), int(self.machineSpeed * self.machineStepsPerUnit.y), int(self.machineSpeed * self.machineStepsPerUnit.z)
-        self.sendOSC(b'/blender/x', [b'spd', sx, sy, sz])
+        self.writeSpeedValue(self.machineSpeed)
         
     def writeSpeedDark(self):
+        self.writeSpeedValue(self.machineSpeedDark)
+        
+    def writeSpeedValue(self, speed):
         # steps per second
-        sx, sy, sz = int(self.machineSpeedDark * self.machineStepsPerUnit.x), int(self.machineSpeedDark * self.machineStepsPerUnit.y), int(self.machineSpeedDark * self.machineStepsPerUnit.z)
-        self.sendOSC(b'/blender/x', [b'spd', sx, sy, sz])
+        sx, sy, sz = int(speed * self.machineStepsPerUnit.x), int(speed * self.machineStepsPerUnit.y), int(speed * self.machineStepsPerUnit.z)
+        self.writeCommand([b'spd', sx, sy, sz])
+        
+    # Planned speed for each move of a lit path buffer. Moving faster than the light painting speed leaves less light per
+    # unit length, which is made up by scaling the LED up, so the speed is also capped where the path's color runs out of
+    # LED output.
+    def planSpeeds(self, buffer):
+        global props
+        peakSpeed = props.light_paint_peak_speed
+        brightest = int(buffer.color.max())
+        if brightest > 0:
+            peakSpeed = min(peakSpeed, self.machineSpeed * 255 / brightest)
+        points = buffer.steps / self.machineStepsArray
+        return planPathSpeeds(points, self.machineSpeed, peakSpeed, props.painting_robot_acceleration, props.painting_robot_jerk, props.speed_plan_step)
+        
+    # Switch to a planned speed and scale the path color by it, so that the light per unit length matches the light painting
+    # speed. Until the path's nxt checkpoint has been written the color is only kept for writeMovement to write after it.
+    def writePlannedSpeed(self, buffer, speed, colorWritten):
+        global currentColor
+        self.writeSpeedValue(speed)
+        color = np.minimum(np.rint(buffer.color * (speed / self.machineSpeed)), 255).astype(np.int32).tolist()
+        if colorWritten:
+            self.writeColor(color[0], color[1], color[2])
+        else:
+            currentColor = color
         
     def writeWorkspaceSize(self):
         # steps
         wx, wy, wz = int(self.machineBounds.x * self.machineStepsPerUnit.x), int(self.machineBounds.y * self.machineStepsPerUnit.y), int(self.machineBounds.z * self.machineStepsPerUnit.z)
-        self.sendOSC(b'/blender/x', [b'siz', wx, wy, wz])
+        self.writeCommand([b'siz', wx, wy, wz])
           
     def writeAxisInversion(self):
         a = self.machineAxisInversions
-        self.sendOSC(b'/blender/x', [b'inv', -1 if a[0] else 1, -1 if a[1] else 1, -1 if a[2] else 1])
+        self.writeCommand([b'inv', -1 if a[0] else 1, -1 if a[1] else 1, -1 if a[2] else 1])
         
     def writeLedCalibration(self):
         calR, calG, calB = int(self.ledCalibration[0] * 1000), int(self.ledCalibration[1] * 1000), int(self.ledCalibration[2] * 1000)
-        self.sendOSC(b'/blender/x', [b'cal', calR, calG, calB])
+        self.writeCommand([b'cal', calR, calG, calB])
       
     def writeFrameNumber(self, context):
-        self.sendOSC(b'/blender/x', [b'frm', context.scene.frame_current])
+        self.writeCommand([b'frm', self.compileFrameNumber])
         
     def writeNextPath(self):
-        self.sendOSC(b'/blender/x', [b'nxt', 0, 0, 0])
+        self.writeCommand([b'nxt', 0, 0, 0])
         
     def writeExposureCount(self):
-        self.sendOSC(b'/blender/x', [b'exc', self.exposureCount, 0, 0])
+        self.writeCommand([b'exc', self.exposureCount, 0, 0])
         
     def writeExposureTime(self):
-        self.sendOSC(b'/blender/x', [b'ext', self.exposureTime, 0, 0])
+        self.writeCommand([b'ext', self.exposureTime, 0, 0])
         
     def writeYieldThreshold(self):
-        self.sendOSC(b'/blender/x', [b'yel', math.floor(self.exposureYieldThreshold) * 1000, 0, 0])
+        self.writeCommand([b'yel', math.floor(self.exposureYieldThreshold) * 1000, 0, 0])
          
     def writeFinish(self):
-        self.sendOSC(b'/blender/x', [b'fin'])
+        self.writeCommand([b'fin'])
         
     
-    # Send path info commands to machine
-    def sendFrameMovement(self, context):
-        global props, currentMachinePos, currentWorldPos, currentColor, pathFollower, followPathConstraint, isFirstMove
+    # Compile the path info commands for the current frame into each machine's frameCommands.
+    # This is a generator that yields after every path evaluation, so that compiling a frame can be spread over
+    # several timer callbacks without freezing the UI (see runCompileJob). sendFrameMovement runs it in one go.
+    def compileFrame(self, context):
+        self.compileFrameNumber = context.scene.frame_current
+        print("Compiling frame ", self.compileFrameNumber)
         
-        print("Sending frame ", context.scene.frame_current)
+        # enable scene props so that geometry loads for collision avoidance raycasting
+        # Unsure if this still works as intended in 3.0+
+        for prop in getCollection('Scene Props').all_objects:
+            prop.hide_viewport = False
+            
+        yield from self.evaluatePaths(context)
+        if len(paintingMachines) > 1:
+            self.partitionPaths(context)
+            
+        for machineIndex, machine in enumerate(paintingMachines):
+            self.useMachine(machine)
+            yield from self.compileMachineFrame(context, machineIndex)
+            self.storeMachine(machine)
+            
+    # Compile the current machine's commands for the paths in its region into frameCommands
+    def compileMachineFrame(self, context, machineIndex):
+        global props, currentSteps, currentWorldPos, currentColor, pathFollower, followPathConstraint, isFirstMove, compileProgress
         
+        self.frameCommands = []
+        self.frameStats = {}
         self.writeFrameNumber(context)
+        
+        # Only send the hardware settings the machine doesn't already hold
+        configStart = len(self.frameCommands)
         self.writeWorkspaceSize()
         self.writeAxisInversion()
         self.writeSpeedDark()
@@ -393,72 +1970,190 @@ class ExecutePainting(Operator):
         self.writeExposureCount()
         self.writeExposureTime()
         self.writeYieldThreshold()
+        config = self.frameCommands[configStart:]
+        self.frameCommands[configStart:] = self.machine.session.configChanges(config, props.machine_rehome_interval)
+        skippedConfig = [values for values in config if values not in self.frameCommands[configStart:]]
+        self.addFrameStat('skippedConfigCommands', len(skippedConfig))
+        self.addFrameStat('skippedConfigBytes', sum(sum(commandBytes(values)) for values in skippedConfig))
         
-        # enable scene props so that geometry loads for collision avoidance raycasting
-        # Unsure if this still works as intended in 3.0+
-        for prop in bpy.data.collections['Scene Props'].all_objects:
-            prop.hide_viewport = False
-            
         # Collect ordered list of light paths
         self.collectPaths(context)
 
         # Iterate through ordered list and send commands
         isFirstMove = True
-        lastPos = None        
         traverseIncrement = props.light_path_traverse_increment
         traverseThreshold = props.light_path_traverse_threshold
+        sampleCount = 0
+        bufferBytes = 0
+        strokeEnd = None    # where the last path ended lit, for the next path of its stroke to continue from
         
-        for path, direction in zip(self.lightPaths, self.lightPathDirections):
-            pathStart = path.data.bevel_factor_start
-            pathEnd = path.data.bevel_factor_end
-            if (pathEnd < pathStart):
-                pathStart, pathEnd = pathEnd, pathStart
-            
-            followPathConstraint.target = path
-            followPathConstraint.offset_factor = max(min(direction, pathEnd), pathStart)
-            bpy.context.view_layer.update() 
-            pos = pathFollower.matrix_world.to_translation()
-            lastPos = pos#.copy()
-            
-            self.writeColor(0,0,0)
-            self.movingToNextPath = True
-            self.writeSpeedDark()
-            self.writeMovement(pos, False)
-            self.movingToNextPath = False
-            self.writeSpeed()
-            
+        for pathIndex, (path, direction) in enumerate(zip(self.lightPaths, self.lightPathDirections)):
+            compileProgress = (self.compileFrameNumber, 0.1 + 0.9 * (machineIndex + pathIndex / len(self.lightPaths)) / len(paintingMachines))
+            world = yield from self.samplePath(path, direction, traverseIncrement)
             color, isBlack = self.getPathColor(path)
-            recordNextPathMarker = not isBlack
-            currentColor = [color[0] * 255, color[1] * 255, color[2] * 255]
+            buffer = self.clipPathBuffer(path, direction, world[self.selectSamples(world, traverseThreshold)], [color[0] * 255, color[1] * 255, color[2] * 255])
+            sampleCount += len(world)
+            bufferBytes += world.nbytes + buffer.nbytes()
+            
+            if len(buffer) == 0:
+                print("Path ", path, " is outside machine bounds after clipping")
+                self.addFrameStat('clippedPaths', 1)
+                strokeEnd = None
+                continue
             
-            alpha = 0.0
-            while alpha <= 1.0:
-                #print("Pos: "+ str(pos) + " Lastpos: " + str(lastPos) + " Dist: " + str((pos - lastPos).length))
-                if (pos - lastPos).length >= traverseThreshold:
-                    if self.writeMovement(pos, recordNextPathMarker) and recordNextPathMarker:
-                        recordNextPathMarker = False
-                    lastPos = pos
-
-                alpha = alpha + traverseIncrement
-                offset = abs(direction - alpha)
-                offset = max(min(offset, pathEnd), pathStart)
+            if self.lightPathJoined[pathIndex] and strokeEnd is not None and np.linalg.norm(buffer.world[0] - strokeEnd) <= props.stroke_join_tolerance + 1e-6:
+                # Draw on through the seam from the previous path of the stroke
+                lightSpeed = [b'spd'] + [int(self.machineSpeed * s) for s in self.machineStepsPerUnit]
+                darkSpeed = [b'spd'] + [int(self.machineSpeedDark * s) for s in self.machineStepsPerUnit]
+                savedCommands, savedTime = seamSavings(currentSteps.tolist(), buffer.steps[0].tolist(), buffer.steps[min(1, len(buffer) - 1)].tolist(), buffer.color.tolist(), lightSpeed, darkSpeed, props.step_merge_tolerance)
+                self.addFrameStat('joinedSeams', 1)
+                self.addFrameStat('seamCommandsSaved', savedCommands)
+                self.addFrameStat('seamTimeSaved', savedTime)
+                currentColor = buffer.color.tolist()
+                self.writeMovement(buffer, 0, False)
+                recordNextPathMarker = False
+            else:
+                self.writeColor(0,0,0)
+                self.movingToNextPath = True
+                self.writeSpeedDark()
+                self.writeMovement(buffer, 0, False)
+                self.movingToNextPath = False
+                self.writeSpeed()
                 
-                followPathConstraint.offset_factor = offset
-                bpy.context.view_layer.update() 
-                pos = pathFollower.matrix_world.to_translation()
-
-            self.writeMovement(pos, recordNextPathMarker)
+                recordNextPathMarker = not isBlack
+                currentColor = buffer.color.tolist()
+            plannedSpeeds = self.planSpeeds(buffer) if props.plan_light_speed else None
+            speed = self.machineSpeed
+            
+            for index in range(1, len(buffer)):
+                if plannedSpeeds is not None and plannedSpeeds[index - 1] != speed:
+                    speed = plannedSpeeds[index - 1]
+                    self.writePlannedSpeed(buffer, speed, not recordNextPathMarker)
+                if buffer.flags[index] & SAMPLE_STROKE_START:
+                    # Path left the workspace; move dark to where it enters again
+                    self.setColorOverride(True)
+                    self.writeMovement(buffer, index, False)
+                    self.setColorOverride(False)
+                else:
+                    self.writeMovement(buffer, index, recordNextPathMarker)
+                    recordNextPathMarker = False
+            strokeEnd = currentWorldPos
         
         if self.homeWandAfterFrame:
             self.writeColor(0, 0, 0)
-            zHeight = max(min(self.propHeightLimit, self.machineBounds.z), 0)
-            self.writePosition(Vector([currentMachinePos.x, currentMachinePos.y, zHeight]))
-            self.writePosition(Vector([0, 0, zHeight]))
+            zHeight = self.retractHeight()
+            zSteps = int(zHeight * self.machineStepsPerUnit.z)
+            homeX, homeY = self.toSteps(self.regionLowerArray)[:2].tolist()
+            self.writeSteps(currentSteps[0], currentSteps[1], zSteps)
+            self.writeSteps(homeX, homeY, zSteps)
         
         self.writeFinish()
         
-        if context.scene.frame_current < context.scene.frame_end:
-            bpy.ops.screen.frame_offset(delta = 1)
+        # Drop zero length moves and merge collinear moves in step space
+        commandCount = len(self.frameCommands)
+        predictedTime = predictExecutionTime(self.frameCommands)
+        self.frameCommands = optimizeMoves(self.frameCommands, props.step_merge_tolerance)
+        self.addFrameStat('mergedMoves', commandCount - len(self.frameCommands))
+        print("Move merge: ", commandCount, " -> ", len(self.frameCommands), " commands, predicted execution time {:.2f}s -> {:.2f}s".format(predictedTime, predictExecutionTime(self.frameCommands)))
+        
+        # Drop redundant col/spd commands, and only keep the result if it provably leaves the machine state unchanged
+        unoptimized = self.frameCommands
+        self.frameCommands = optimizeStateCommands(unoptimized, props.step_merge_tolerance)
+        mismatch = verifyStateEquivalence(unoptimized, self.frameCommands, props.step_merge_tolerance)
+        if mismatch is not None:
+            print("STATE COMMAND OPTIMIZATION FAILED VERIFICATION, SENDING UNOPTIMIZED COMMANDS: ", mismatch)
+            self.frameCommands = unoptimized
+        self.addFrameStat('removedStateCommands', len(unoptimized) - len(self.frameCommands))
+        self.addFrameStat('samples', sampleCount)
+        self.addFrameStat('bufferBytes', bufferBytes)
+        self.addFrameStat('predictedTime', predictExecutionTime(self.frameCommands))
+        if self.frameStats.get('joinedSeams', 0) > 0:
+            print("Stroke joining: {} seams removed, {} commands and {:.2f}s saved".format(self.frameStats['joinedSeams'], self.frameStats['seamCommandsSaved'], self.frameStats['seamTimeSaved']))
+        if 'sweepSamples' in self.frameStats or 'sweepEvaluations' in self.frameStats:
+            saved = self.frameStats.get('sweepSamples', 0) - self.frameStats.get('sweepEvaluations', 0)
+            pathSweepCache.evaluationsSaved += saved
+            print("Path sweep reuse: {} samples read from sweeps, {} evaluations to sweep paths, {} evaluations saved this frame, {} since the first frame".format(
+                self.frameStats.get('sweepSamples', 0), self.frameStats.get('sweepEvaluations', 0), saved, pathSweepCache.evaluationsSaved))
+        if props.plan_light_speed:
+            # The same stream with every lit move at the light painting speed
+            lightSpeed = [b'spd'] + [int(self.machineSpeed * s) for s in self.machineStepsPerUnit]
+            darkSpeed = [b'spd'] + [int(self.machineSpeedDark * s) for s in self.machineStepsPerUnit]
+            constantTime = predictExecutionTime([lightSpeed if values[0] == b'spd' and values != darkSpeed else values for values in self.frameCommands])
+            self.addFrameStat('constantSpeedTime', constantTime)
+            print("Speed plan: predicted execution time {:.2f}s at constant speed -> {:.2f}s planned".format(constantTime, self.frameStats['predictedTime']))
+        compileProgress = (self.compileFrameNumber, 0.1 + 0.9 * (machineIndex + 1) / len(paintingMachines))
+        
+    # Send the compiled frame and advance to the next frame
+    def sendCompiledFrame(self, context):
+        frame = self.compileFrameNumber
+        print("Sending frame ", frame)
+        sendStart = time.perf_counter()
+        for machine in paintingMachines:
+            self.sendFrameCommands(machine)
+            machine.session.frameSent(frame, machine.frameCommands)
+            print("Frame stats" + (" " + machine.name if len(paintingMachines) > 1 else "") + ": ", machine.frameStats)
+        shootJournal.write('sent', frame = frame, fingerprint = self.inputFingerprint, compileTime = self.compileTime, sendTime = time.perf_counter() - sendStart,
+                           machines = {machine.name: self.journalStream(machine) for machine in paintingMachines})
+        
+        if frame < context.scene.frame_end:
+            context.scene.frame_set(frame + 1)
+            
+    def journalStream(self, machine):
+        return {'hash': streamHash(machine.frameCommands), 'commands': len(machine.frameCommands), 'predictedTime': machine.frameStats.get('predictedTime', 0.0), 'endSteps': np.asarray(machine.currentSteps).tolist(),
+                'endWorld': np.asarray(machine.currentWorldPos, dtype = np.float32).tolist(), 'order': [[key, int(direction)] for key, direction in zip(*machine.previousOrdering[:2])]}
+            
+    # Compile the current frame without yielding to the UI
+    def compileFrameNow(self, context):
+        compileStart = time.perf_counter()
+        for _ in self.compileFrame(context):
+            pass
+        self.compileTime = time.perf_counter() - compileStart
+        
+    # Compile and send the current frame without yielding to the UI
+    def sendFrameMovement(self, context):
+        self.compileFrameNow(context)
+        self.sendCompiledFrame(context)
+        
+    # Put each machine where the journal says the frame before firstFrame left it. The world position is restored exactly,
+    # since partitioning depends on it; journals from before it was recorded only have the steps to go on.
+    def restoreMachinePositions(self, sent, firstFrame):
+        record = sent.get(firstFrame - 1)
+        for machine in paintingMachines:
+            if record is not None and machine.name in record['machines']:
+                stream = record['machines'][machine.name]
+                machine.currentSteps = np.array(stream['endSteps'], dtype = np.int32)
+                if 'endWorld' in stream:
+                    machine.currentWorldPos = np.array(stream['endWorld'], dtype = np.float32)
+                else:
+                    machine.currentWorldPos = (machine.offset + machine.currentSteps / self.machineStepsArray).astype(np.float32)
+            
+    # Check that the scene still produces the streams the journal recorded for the frames already painted, by compiling
+    # the last painted frame again and comparing its stream hashes. The input fingerprint doesn't see every setting that
+    # changes a stream, like modifier and constraint parameters, so a matching fingerprint is only reported, not trusted.
+    # Returns None if the shoot can resume, otherwise the reason it can't.
+    def verifyResume(self, context, sent, completed, resumeFrame):
+        painted = [frame for frame in completed if frame < resumeFrame]
+        if not painted:
+            return None
+        
+        frame = max(painted)
+        unchanged = all(sent[done]['fingerprint'] == self.inputFingerprint for done in painted)
+        print("Resume: input fingerprint {} the journal, compiling frame {} again to compare".format("matches" if unchanged else "differs from", frame))
+        context.scene.frame_set(frame)
+        self.restoreMachinePositions(sent, frame)
+        for machine in paintingMachines:
+            machine.replayOrdering = sent[frame]['machines'].get(machine.name, {}).get('order')
+        self.compileFrameNow(context)
+        for machine in paintingMachines:
+            machine.replayOrdering = None
+            recorded = sent[frame]['machines'].get(machine.name)
+            if recorded is None or recorded['hash'] != streamHash(machine.frameCommands):
+                return "frame {} no longer compiles to the stream that was painted for {}".format(frame, machine.name)
+            machine.session.forceResync("resume verification")
+            machine.previousOrdering = None
+            machine.referenceLinkLength = None
+        print("Resume: frame {} compiles to the same streams in {:.2f}s".format(frame, self.compileTime))
+        return None
             
             
     # Set up socket for OSC receive server
@@ -468,6 +2163,7 @@ class ExecutePainting(Operator):
     def cleanup(self):
         global executingPainting, pathFollower
         #osc_receiver.stop_all()
+        stopCompileJob()
         executingPainting = False
         if not (pathFollower is None):
             bpy.context.view_layer.objects.active = pathFollower
@@ -483,35 +2179,38 @@ class ExecutePainting(Operator):
             self.cleanup()
             return {'CANCELLED'}
         
+        if commandSender.error is not None:
+            self.report({'ERROR'}, "Light painting stopped: " + commandSender.error)
+            self.cleanup()
+            return {'CANCELLED'}
+        
+        if compileError is not None:
+            self.report({'ERROR'}, "Light painting stopped: " + compileError)
+            self.cleanup()
+            return {'CANCELLED'}
+        
         if event.type == 'TIMER':
             # Check for incoming signal from OSC that path has been drawn
             #data = my_receiver.fget_data()
             #if not (data is None):
             #    print("OSC data received: ", data)
             #if not (data is None) and data[0] == "finished" and data[2] == context.scene.frame_current - 1:
-            if finishReceived:
+            if finishReceived and compileJob is None:
                 finishReceived = False
-                isLastFrame = context.scene.frame_current >= context.scene.frame_end
-                self.sendFrameMovement(context)
-                if isLastFrame:
-                    self.cleanup()
-                    return {'FINISHED'}
+                self.isLastFrame = context.scene.frame_current >= context.scene.frame_end
+                startCompileJob(self)
+            elif self.isLastFrame and compileJob is None:
+                self.cleanup()
+                return {'FINISHED'}
         
         return {'PASS_THROUGH'}
 
 
-    # Execute is called once starting drawing
-    def execute(self, context):          
-        global props, cancelClicked, executingPainting, pathFollower, followPathConstraint
-        
-        executingPainting = True
-        cancelClicked = False
-        
-        self.machineOffset = Vector(props.painting_robot_position)
+    # Read the machine and exposure settings from the scene
+    def loadSettings(self, props):
         self.machineStepsPerUnit = Vector(props.painting_robot_steps_per_unit)
         self.machineSpeed = props.light_paint_max_speed
         self.machineSpeedDark = props.light_paint_dark_speed
-        self.machineBounds = Vector(props.painting_robot_bounds)
         self.machineAxisInversions = props.painting_robot_axis_inversions
         self.propHeightLimit = props.prop_height_limit
         self.ledCalibration = props.led_calibration
@@ -519,11 +2218,11 @@ class ExecutePainting(Operator):
         self.exposureTime = props.exposure_time
         self.exposureYieldThreshold = props.exposure_yield_threshold
         self.homeWandAfterFrame = props.home_wand_after_frame
+        self.machineStepsArray = np.array(self.machineStepsPerUnit, dtype = np.float64)
         
-        bpy.ops.screen.animation_cancel(restore_frame = False)
-        bpy.ops.screen.frame_jump(end = False)
-        bpy.context.view_layer.update() 
-        
+    # Add the empty that is moved along each light path by its Follow Path constraint to evaluate positions
+    def addPathFollower(self):
+        global pathFollower, followPathConstraint
         bpy.ops.object.empty_add(location = (0,0,0))
         bpy.ops.object.constraint_add(type='FOLLOW_PATH')
         pathFollower = bpy.context.view_layer.objects.active
@@ -531,11 +2230,93 @@ class ExecutePainting(Operator):
         followPathConstraint = pathFollower.constraints["Follow Path"]
         followPathConstraint.use_fixed_location = True
         
+    # Compile every frame from frame_start to frame_end in the foreground and write the command streams to capture_path
+    # instead of sending them. No OSC connection or journal is used, so this also works in background mode; see
+    # LightPaintingGolden.py.
+    def captureFrames(self, context):
+        global pathColorTable, pathSweepCache
+        scene = context.scene
+        for machine in buildPaintingMachines(scene):
+            machine.session.forceResync("capture start")
+        pathColorTable = PathColorTable.buildOrReuse(pathColorTable, getCollection('Light Paths').all_objects, scene.frame_start, scene.frame_end)
+        pathSweepCache = PathSweepCache()
+        scene.frame_set(scene.frame_start)
+        self.addPathFollower()
+        
+        frames = []
+        try:
+            while True:
+                self.compileFrameNow(context)
+                machines = {}
+                for machine in paintingMachines:
+                    machines[machine.name] = self.journalStream(machine)
+                    machines[machine.name]['commands'] = [[values[0].decode()] + list(values[1:]) for values in machine.frameCommands]
+                    machine.session.frameSent(scene.frame_current, machine.frameCommands)
+                    machine.session.frameAcknowledged(scene.frame_current)
+                frames.append({'frame': scene.frame_current, 'compileTime': self.compileTime, 'machines': machines})
+                print("Captured frame {} in {:.2f}s".format(scene.frame_current, self.compileTime))
+                if scene.frame_current >= scene.frame_end:
+                    break
+                scene.frame_set(scene.frame_current + 1)
+        finally:
+            self.cleanup()
+            
+        with open(self.capture_path, 'w') as file:
+            json.dump({'blend': bpy.data.filepath, 'frames': frames}, file)
+        print("Captured {} frames to {}".format(len(frames), self.capture_path))
+        return {'FINISHED'}
+    
+    # Execute is called once starting drawing
+    def execute(self, context):          
+        global props, cancelClicked, executingPainting, pathFollower, followPathConstraint, pathColorTable, pathSweepCache, shootJournal, compileError
+        
+        executingPainting = True
+        cancelClicked = False
+        props = context.scene
+        self.loadSettings(props)
+        if self.capture_path:
+            return self.captureFrames(context)
+        startOSC()
+        commandSender.reset()
+        compileError = None
+        
+        bpy.ops.screen.animation_cancel(restore_frame = False)
+        if self.resume_frame < 0:
+            bpy.ops.screen.frame_jump(end = False)
+        bpy.context.view_layer.update() 
+        
+        # Fingerprint the inputs at the shoot's first frame, before the path follower is added
+        shootJournal = ShootJournal(ShootJournal.pathForBlend())
+        if self.resume_frame >= 0:
+            shootStart, sent, completed = shootJournal.shootState()
+            context.scene.frame_set(shootStart['firstFrame'])
+        self.inputFingerprint = computeInputFingerprint(context.scene)
+        
+        for machine in buildPaintingMachines(props):
+            machine.session.forceResync("execution start")
+        pathColorTable = PathColorTable.buildOrReuse(pathColorTable, getCollection('Light Paths').all_objects, context.scene.frame_start, context.scene.frame_end)
+        pathSweepCache = PathSweepCache()
+        
+        self.addPathFollower()
+        
+        if self.resume_frame >= 0:
+            problem = self.verifyResume(context, sent, completed, self.resume_frame)
+            if problem is not None:
+                self.report({'ERROR'}, "Cannot resume: " + problem)
+                self.cleanup()
+                return {'CANCELLED'}
+            context.scene.frame_set(self.resume_frame)
+            self.restoreMachinePositions(sent, self.resume_frame)
+        shootJournal.write('start', firstFrame = context.scene.frame_current, lastFrame = context.scene.frame_end, resumed = self.resume_frame >= 0,
+                           machines = [machine.name for machine in paintingMachines], fingerprint = self.inputFingerprint)
+        print("Shoot journal: ", shootJournal.path)
+        
         wm = context.window_manager
         self._timer = wm.event_timer_add(time_step = 1.0, window = context.window)
         wm.modal_handler_add(self)
         
-        self.sendFrameMovement(context)
+        self.isLastFrame = False
+        startCompileJob(self)
       
         return {'RUNNING_MODAL'}
 
@@ -546,6 +2327,27 @@ class ExecutePainting(Operator):
     
     
 
+# Resume the shoot recorded in the journal next to the .blend file at its first frame that isn't finished on every machine
+class ResumePainting(Operator):
+    bl_idname = 'lightpainting.resumepainting'
+    bl_label = 'Resume light painting from the shoot journal'
+    
+    def execute(self, context):
+        journal = ShootJournal(ShootJournal.pathForBlend())
+        shootStart, sent, completed = journal.shootState()
+        if shootStart is None:
+            self.report({'ERROR'}, "No shoot journal at " + journal.path)
+            return {'CANCELLED'}
+        
+        remaining = [frame for frame in range(shootStart['firstFrame'], context.scene.frame_end + 1) if frame not in completed]
+        if not remaining:
+            self.report({'INFO'}, "Every frame of the shoot has been painted")
+            return {'CANCELLED'}
+        print("Resuming shoot at frame {}, {} frames painted".format(remaining[0], len(completed)))
+        result = bpy.ops.lightpainting.executepainting(resume_frame = remaining[0])
+        return {'CANCELLED'} if 'CANCELLED' in result else {'FINISHED'}
+    
+
 class CancelExecution(Operator):
     bl_idname = 'lightpainting.cancelexecutepainting'
     bl_label = 'Cancel light painting execution'
@@ -558,6 +2360,74 @@ class CancelExecution(Operator):
         return {'FINISHED'}
 
 
+# An additional machine painting alongside the panel's painter, with its own workspace and relay.
+# The relay must be set up to listen on port_out and reply to port_in.
+class PaintingMachineSettings(bpy.types.PropertyGroup):
+    position: bpy.props.FloatVectorProperty(name="Position", description = "The position of this machine's origin relative to the Blender origin.", default = (-45/2, -45/2, 0), step = 0.1, precision = 2, unit = 'LENGTH')
+    bounds: bpy.props.FloatVectorProperty(name="Bounds", description = "Bounds of this machine.", default = (45, 45, 20), precision = 1, unit = 'LENGTH')
+    ip_out: bpy.props.StringProperty(name="Relay IP", description = "IP address of this machine's relay.", default = "127.0.0.1")
+    port_out: bpy.props.IntProperty(name="Relay Port", description = "Port this machine's relay listens on.", min = 1, max = 65535, default = 8001)
+    port_in: bpy.props.IntProperty(name="Reply Port", description = "Port this machine's relay sends /finished to. Must be different for every machine.", min = 1, max = 65535, default = 9001)
+    
+    
+class AddPaintingMachine(Operator):
+    bl_idname = 'lightpainting.addmachine'
+    bl_label = 'Add painting machine'
+    
+    def execute(self, context):
+        scene = context.scene
+        settings = scene.painting_machines.add()
+        settings.name = "Machine {}".format(len(scene.painting_machines) + 1)
+        settings.position = scene.painting_robot_position
+        settings.bounds = scene.painting_robot_bounds
+        settings.port_out = port_out + len(scene.painting_machines)
+        settings.port_in = port_in + len(scene.painting_machines)
+        return {'FINISHED'}
+    
+    
+class RemovePaintingMachine(Operator):
+    bl_idname = 'lightpainting.removemachine'
+    bl_label = 'Remove painting machine'
+    
+    index: bpy.props.IntProperty()
+    
+    def execute(self, context):
+        context.scene.painting_machines.remove(self.index)
+        return {'FINISHED'}
+
+
+# Time viewport redraws and frame changes with beveled paths and with the line preview, then restore the current mode
+class BenchmarkPathPreview(Operator):
+    bl_idname = 'lightpainting.benchmarkpreview'
+    bl_label = 'Compare viewport and update times with and without the path preview'
+    
+    def execute(self, context):
+        scene = context.scene
+        previewWas = scene.light_path_preview
+        frameWas = scene.frame_current
+        frames = [scene.frame_start + i % (scene.frame_end - scene.frame_start + 1) for i in range(1, preview_benchmark_iterations + 1)]
+        results = []
+        for preview in (False, True):
+            scene.light_path_preview = preview
+            scene.frame_set(frameWas)
+            
+            startTime = time.perf_counter()
+            bpy.ops.wm.redraw_timer(type = 'DRAW_WIN_SWAP', iterations = preview_benchmark_iterations)
+            frameRate = preview_benchmark_iterations / max(time.perf_counter() - startTime, 1e-9)
+            
+            startTime = time.perf_counter()
+            for frame in frames:
+                scene.frame_set(frame)
+            updateTime = (time.perf_counter() - startTime) / len(frames)
+            results.append("{}: {:.1f} fps, {:.1f} ms per frame update".format("Preview" if preview else "Beveled", frameRate, updateTime * 1000))
+            
+        scene.light_path_preview = previewWas
+        scene.frame_set(frameWas)
+        print("Path preview benchmark: ", ", ".join(results))
+        self.report({'INFO'}, ", ".join(results))
+        return {'FINISHED'}
+
+
 #Class for the panel with input UI
 class View3dPanel(Panel):
     bl_idname = "OBJECT_PT_light_paint_export"
@@ -598,38 +2468,15 @@ class View3dPanel(Panel):
             
         machineOriginEmpty.scale = machineBounds / 6
         machineOriginEmpty.location = machineOffset #+ Vector([machineBounds.x if inversions[0] else 0, machineBounds.y if inversions[1] else 0, machineBounds.z if inversions[2] else 0])   
+        
+    # Switch between drawing the light paths as preview lines and as beveled curves
+    def setPathPreview(self, context):
+        setPathBevels(not self.light_path_preview)
+        if self.light_path_preview:
+            startPathPreview(context)
+        else:
+            stopPathPreview()
             
-    # Custom parameters
-    bpy.types.Scene.light_path_traverse_increment = bpy.props.FloatProperty(name="Path Traversal Increment", description = "The amount the path position will be incremented as it traverses along a path from 0 to 1. Use lower values for longer paths.", default = 0.01, min = 0.001, max = 1.0, soft_min = 0.0, soft_max = 0.5, step = 0.001, precision = 3)
-    
-    bpy.types.Scene.light_path_traverse_threshold = bpy.props.FloatProperty(name="Path Traversal Threshold", description = "The distance threshold from the last recorded point until a new path point is recorded.", default = 0.5, min = 0, max = 100.0, soft_min = 0.0, soft_max = 2.0, step = 0.01, precision = 3, unit = 'LENGTH')
-    
-    bpy.types.Scene.follow_black_paths = bpy.props.BoolProperty(name="Follow Black Paths", description = "Follow paths that have a color of 0, 0, 0, which could be used as manual obstacle avoidance.", default = False)
-    
-    bpy.types.Scene.painting_robot_position = bpy.props.FloatVectorProperty(name="Painter Position", description = "The position of the light painting robot position origin relative to the Blender origin.", default = (-45/2, -45/2, 0), step = 0.1, precision = 2, unit = 'LENGTH', update = setMachineVolumeIndicator)
-    
-    bpy.types.Scene.painting_robot_steps_per_unit = bpy.props.FloatVectorProperty(name="Painter Steps / Unit", description = "Number of steps per unit distance.", default = (400, 400, 400),  precision = 2)
-    
-    bpy.types.Scene.painting_robot_bounds = bpy.props.FloatVectorProperty(name="Painter Bounds", description = "Bounds of light painting robot. Points outside of this volume will not be sent.", default = (45, 45, 20),  precision = 1, unit = 'LENGTH', update = setMachineVolumeIndicator)
-    
-    bpy.types.Scene.painting_robot_axis_inversions = bpy.props.BoolVectorProperty(name="Invert Axes", description = "Invert direction of each axis", default = (False, False, True), update = setMachineVolumeIndicator)
-    
-    bpy.types.Scene.light_paint_max_speed = bpy.props.FloatProperty(name="Light Painting Speed", description = "Travel speed for light painting robot.", default = 10.0, min = 0.1, max = 1000.0, soft_min = 0.1, soft_max = 1000.0, step = 0.1, precision = 1, unit = 'VELOCITY')
-    
-    bpy.types.Scene.light_paint_dark_speed = bpy.props.FloatProperty(name="Dark Speed", description = "Travel speed for light painting robot when LED is dark.", default = 20.0, min = 0.1, max = 1000.0, soft_min = 0.1, soft_max = 1000.0, step = 0.1, precision = 1, unit = 'VELOCITY')
-    
-    bpy.types.Scene.prop_height_limit = bpy.props.FloatProperty(name="Prop Height Limit", description = "Height to retract Z axis to during obstacle avoidance.", default = 20.0, soft_min = 0, soft_max = 1000.0, step = 0.1, precision = 1, unit = 'LENGTH')
-    
-    bpy.types.Scene.led_calibration = bpy.props.FloatVectorProperty(name="LED Calibration", description = "RGB scaling values to correct LED colors", default = (0.4, 1.0, 1.0), min = 0.0, max = 1.0, step = 0.001, precision = 3, unit = 'NONE')
-    
-    bpy.types.Scene.num_exposures_per_frame = bpy.props.IntProperty(name="Exposures Per Frame", description = "Number of exposures per frame. Set to match Dragonframe.", min = 1, max = 20, default = 1)
-  
-    bpy.types.Scene.exposure_time = bpy.props.IntProperty(name="Exposure Time", description = "Duration of each exposure in seconds. Round down if cannot reach exact value. Set to max Dragonframe.", min = 1, max = 60, default = 30)
-    
-    bpy.types.Scene.exposure_yield_threshold = bpy.props.FloatProperty(name="Next Exposure Yield Threshold", description = "If a path begins within this many seconds of the end the of exposure, yield and resume at the next exposure. Set this to be about the amount of time it takes to draw the longest path.", min = 0, max = 60, default = 0.8, soft_min = 0.5, soft_max = 10, precision = 1)
-       
-    bpy.types.Scene.home_wand_after_frame = bpy.props.BoolProperty(name="Home Wand After Frame", description = "Send the wand to the home position after the final exposure of each frame.", default = False)
-     
     # Add UI elements here
     # draw method executed every time anything changes.
     def draw(self, context): 
@@ -639,11 +2486,6 @@ class View3dPanel(Panel):
         scene = context.scene
         props = scene
         
-        # Set of SceneProps collectios for obstacle avoidance
-        if "Scene Props" not in bpy.data.collections:
-            sceneProps = bpy.data.collections.new("Scene Props")
-            bpy.context.scene.collection.children.link(sceneProps)
-            
         # Path paremeters
         layout.label(text="Path Interpretation", icon = 'OUTLINER_OB_CURVE')
         row = layout.row()
@@ -651,7 +2493,20 @@ class View3dPanel(Panel):
         row = layout.row()
         row.prop(props, "light_path_traverse_threshold")
         row = layout.row()
+        row.prop(props, "step_merge_tolerance")
+        row = layout.row()
         row.prop(props, "follow_black_paths")
+        row = layout.row()
+        row.prop(props, "stroke_join_tolerance")
+        row = layout.row()
+        row.prop(props, "reuse_path_sweeps")
+        row = layout.row()
+        row.prop(props, "path_ordering")
+        row = layout.row()
+        row.prop(props, "compare_path_ordering")
+        row = layout.row()
+        row.prop(props, "light_path_preview")
+        row.operator('lightpainting.benchmarkpreview', text = '', icon = 'TIME')
 
         # Hardware parameters
         layout.separator()
@@ -667,6 +2522,17 @@ class View3dPanel(Panel):
         row = layout.row()
         row.prop(props, "light_paint_dark_speed")
         row = layout.row()
+        row.prop(props, "plan_light_speed")
+        if props.plan_light_speed:
+            row = layout.row()
+            row.prop(props, "light_paint_peak_speed")
+            row = layout.row()
+            row.prop(props, "painting_robot_acceleration")
+            row = layout.row()
+            row.prop(props, "painting_robot_jerk")
+            row = layout.row()
+            row.prop(props, "speed_plan_step")
+        row = layout.row()
         row.prop(props, "painting_robot_steps_per_unit")
         row = layout.row()
         row.prop(props, "painting_robot_axis_inversions")
@@ -674,6 +2540,31 @@ class View3dPanel(Panel):
         row.prop(props, "prop_height_limit")
         row = layout.row()
         row.prop(props, "led_calibration")
+        row = layout.row()
+        row.prop(props, "machine_rehome_interval")
+        
+        # Additional machines painting the same scene
+        layout.label(text="Additional Machines", icon = 'MOD_ARRAY')
+        for index, machine in enumerate(props.painting_machines):
+            box = layout.box()
+            row = box.row()
+            row.prop(machine, "name", text = "")
+            row.operator('lightpainting.removemachine', text = '', icon = 'X').index = index
+            split = box.split()
+            col = split.column()
+            col.prop(machine, "position")
+            col = split.column()
+            col.prop(machine, "bounds")
+            row = box.row()
+            row.prop(machine, "ip_out")
+            row = box.row()
+            row.prop(machine, "port_out")
+            row.prop(machine, "port_in")
+        if len(props.painting_machines) > 0:
+            row = layout.row()
+            row.prop(props, "machine_clearance")
+        row = layout.row()
+        row.operator('lightpainting.addmachine', text = 'Add Machine', icon = 'ADD')
         
         # Exposure paremeters
         layout.label(text="Exposure Settings", icon = 'CAMERA_DATA')
@@ -700,20 +2591,223 @@ class View3dPanel(Panel):
         row.scale_y = 2.0
         if executingPainting == False:
             row.operator('lightpainting.executepainting', text = 'Execute', icon = 'PLAY')
+            row = layout.row()
+            row.operator('lightpainting.resumepainting', text = 'Resume', icon = 'RECOVER_LAST')
         else:
             row.operator('lightpainting.cancelexecutepainting', text = 'Cancel', icon = 'CANCEL')
+            
+        if compileProgress is not None:
+            row = layout.row()
+            row.label(text = "Compiling frame {}: {:.0%}".format(compileProgress[0], compileProgress[1]), icon = 'TIME')
                  
-# Register
+# Scene properties shown in the panel. They are added to bpy.types.Scene in register() rather than at import,
+# so loading or reloading the module has no side effects.
+def sceneProperties():
+    return {
+        'light_path_traverse_increment': bpy.props.FloatProperty(name="Path Traversal Increment", description = "The amount the path position will be incremented as it traverses along a path from 0 to 1. Use lower values for longer paths.", default = 0.01, min = 0.001, max = 1.0, soft_min = 0.0, soft_max = 0.5, step = 0.001, precision = 3),
+        'light_path_traverse_threshold': bpy.props.FloatProperty(name="Path Traversal Threshold", description = "The distance threshold from the last recorded point until a new path point is recorded.", default = 0.5, min = 0, max = 100.0, soft_min = 0.0, soft_max = 2.0, step = 0.01, precision = 3, unit = 'LENGTH'),
+        'step_merge_tolerance': bpy.props.FloatProperty(name="Step Merge Tolerance", description = "Consecutive moves are merged into one when the points between them are within this many steps of a straight line.", default = 1.0, min = 0.0, max = 100.0, soft_min = 0.0, soft_max = 10.0, step = 10, precision = 1),
+        'follow_black_paths': bpy.props.BoolProperty(name="Follow Black Paths", description = "Follow paths that have a color of 0, 0, 0, which could be used as manual obstacle avoidance.", default = False),
+        'stroke_join_tolerance': bpy.props.FloatProperty(name="Stroke Join Tolerance", description = "Paths of the same color whose ends are within this distance are drawn as one continuous stroke, without going dark at the seam. Ends where more than two paths meet are not joined. 0 disables joining.", default = 0.01, min = 0.0, soft_max = 1.0, step = 0.1, precision = 3, unit = 'LENGTH'),
+        'reuse_path_sweeps': bpy.props.BoolProperty(name="Reuse Path Sweeps", description = "Sample paths whose shape doesn't change between frames once over their whole length, and take later frames' samples from that, so strokes that only animate their bevel factors aren't evaluated again every frame. The ends of the drawn range are interpolated between samples.", default = True),
+        'path_ordering': bpy.props.EnumProperty(name="Path Ordering", description = "How the order light paths are drawn in is found each frame.", items = [('NEAREST', "Nearest Neighbour", "Start at the highest endpoint and always move to the closest remaining path"), ('WARM_START', "Warm Start", "Reuse the previous frame's order, repairing it for added, removed and moved paths. Falls back to nearest neighbour if the tour gets longer.")], default = 'WARM_START'),
+        'compare_path_ordering': bpy.props.BoolProperty(name="Compare Path Ordering", description = "Also time the nearest neighbour ordering on warm started frames and report both tour lengths.", default = False),
+        'light_path_preview': bpy.props.BoolProperty(name="Path Preview", description = "Draw light paths as colored lines with their bevels disabled, which keeps the viewport and exporter fast in scenes with many paths. Turn off to bring the bevels back for final-look renders.", default = False, update = View3dPanel.setPathPreview),
+        'painting_robot_position': bpy.props.FloatVectorProperty(name="Painter Position", description = "The position of the light painting robot position origin relative to the Blender origin.", default = (-45/2, -45/2, 0), step = 0.1, precision = 2, unit = 'LENGTH', update = View3dPanel.setMachineVolumeIndicator),
+        'painting_robot_steps_per_unit': bpy.props.FloatVectorProperty(name="Painter Steps / Unit", description = "Number of steps per unit distance.", default = (400, 400, 400),  precision = 2),
+        'painting_robot_bounds': bpy.props.FloatVectorProperty(name="Painter Bounds", description = "Bounds of light painting robot. Points outside of this volume will not be sent.", default = (45, 45, 20),  precision = 1, unit = 'LENGTH', update = View3dPanel.setMachineVolumeIndicator),
+        'painting_robot_axis_inversions': bpy.props.BoolVectorProperty(name="Invert Axes", description = "Invert direction of each axis", default = (False, False, True), update = View3dPanel.setMachineVolumeIndicator),
+        'light_paint_max_speed': bpy.props.FloatProperty(name="Light Painting Speed", description = "Travel speed for light painting robot.", default = 10.0, min = 0.1, max = 1000.0, soft_min = 0.1, soft_max = 1000.0, step = 0.1, precision = 1, unit = 'VELOCITY'),
+        'light_paint_dark_speed': bpy.props.FloatProperty(name="Dark Speed", description = "Travel speed for light painting robot when LED is dark.", default = 20.0, min = 0.1, max = 1000.0, soft_min = 0.1, soft_max = 1000.0, step = 0.1, precision = 1, unit = 'VELOCITY'),
+        'plan_light_speed': bpy.props.BoolProperty(name="Plan Light Painting Speed", description = "Draw straighter parts of lit paths faster than the light painting speed, within the acceleration and jerk limits, and scale the LED up to keep the same light per unit length.", default = False),
+        'light_paint_peak_speed': bpy.props.FloatProperty(name="Peak Light Painting Speed", description = "Fastest speed a planned lit move may use. Paths whose color leaves no LED headroom are not sped up.", default = 30.0, min = 0.1, max = 1000.0, soft_min = 0.1, soft_max = 1000.0, step = 0.1, precision = 1, unit = 'VELOCITY'),
+        'painting_robot_acceleration': bpy.props.FloatVectorProperty(name="Painter Acceleration", description = "Per axis acceleration limit for planned speed changes.", default = (100, 100, 100), min = 0.1, precision = 1, unit = 'ACCELERATION'),
+        'painting_robot_jerk': bpy.props.FloatVectorProperty(name="Painter Jerk", description = "Per axis limit on the instant speed change at a junction between moves, from a change of direction or of speed. At least the light painting speed, which is drawn from standstill.", default = (20, 20, 20), min = 0.1, precision = 1, unit = 'VELOCITY'),
+        'speed_plan_step': bpy.props.FloatProperty(name="Speed Plan Step", description = "Planned speeds are rounded down to steps of this ratio, so speed changes smaller than this are not sent. Smaller steps draw faster but send more commands.", default = 0.25, min = 0.01, max = 1.0, step = 1, precision = 2),
+        'prop_height_limit': bpy.props.FloatProperty(name="Prop Height Limit", description = "Height to retract Z axis to during obstacle avoidance.", default = 20.0, soft_min = 0, soft_max = 1000.0, step = 0.1, precision = 1, unit = 'LENGTH'),
+        'led_calibration': bpy.props.FloatVectorProperty(name="LED Calibration", description = "RGB scaling values to correct LED colors", default = (0.4, 1.0, 1.0), min = 0.0, max = 1.0, step = 0.001, precision = 3, unit = 'NONE'),
+        'num_exposures_per_frame': bpy.props.IntProperty(name="Exposures Per Frame", description = "Number of exposures per frame. Set to match Dragonframe.", min = 1, max = 20, default = 1),
+        'exposure_time': bpy.props.IntProperty(name="Exposure Time", description = "Duration of each exposure in seconds. Round down if cannot reach exact value. Set to max Dragonframe.", min = 1, max = 60, default = 30),
+        'exposure_yield_threshold': bpy.props.FloatProperty(name="Next Exposure Yield Threshold", description = "If a path begins within this many seconds of the end the of exposure, yield and resume at the next exposure. Set this to be about the amount of time it takes to draw the longest path.", min = 0, max = 60, default = 0.8, soft_min = 0.5, soft_max = 10, precision = 1),
+        'machine_rehome_interval': bpy.props.IntProperty(name="Rehome Frame Interval", description = "Number of frames between machine rehomes. Set to match homeFrameFrequency in the Arduino sketch. All hardware settings are resent on these frames. 0 only resends at execution start and on relay startup.", min = 0, max = 1000, default = 20),
+        'painting_machines': bpy.props.CollectionProperty(type = PaintingMachineSettings),
+        'machine_clearance': bpy.props.FloatProperty(name="Machine Clearance", description = "Gap left between the regions of neighbouring machines. Path segments inside the gap are not drawn.", default = 0.0, min = 0.0, soft_max = 10.0, step = 0.1, precision = 2, unit = 'LENGTH'),
+        'home_wand_after_frame': bpy.props.BoolProperty(name="Home Wand After Frame", description = "Send the wand to the home position after the final exposure of each frame.", default = False),
+    }
+
+
+# Sends the frames' commands from a background thread, so that socket writes and logging never hold up Blender's main
+# thread. A frame's commands are grouped into OSC bundles of up to osc_bundle_bytes, one datagram each, and queued in
+# order. The queue is bounded: when the socket can't keep up, queueing waits for room, and gives up with an error after
+# command_queue_timeout. fin goes last and is only sent once every bundle of its frame was written without error. The
+# first error is kept in error for the operator to report; nothing more is sent until it is cleared.
+osc_bundle_bytes = 1024     # LightPaintingRelay.pde receives datagrams of up to 1536 bytes
+command_queue_size = 64     # bundles
+command_queue_timeout = 10.0
+
+class CommandSender:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize = command_queue_size)
+        self.error = None
+        self.stopped = False
+        self.thread = threading.Thread(target = self.run, name = "Light painting command sender", daemon = True)
+        self.thread.start()
+        
+    # Queue a machine's frame for sending. Returns the deepest the queue got while queueing, in bundles.
+    def sendFrame(self, sender, address, commands):
+        depth = 0
+        bundle = []
+        bundleBytes = 16    # "#bundle" and the time tag
+        for values in commands:
+            if self.error is not None:
+                return depth
+            if values[0] == b'fin':
+                continue
+            messageBytes = 4 + commandBytes(values)[0]
+            if bundle and bundleBytes + messageBytes > osc_bundle_bytes:
+                depth = max(depth, self.put(('bundle', sender, bundle)))
+                bundle = []
+                bundleBytes = 16
+            bundle.append((address, values))
+            bundleBytes += messageBytes
+        if self.error is not None:
+            return depth
+        if bundle:
+            depth = max(depth, self.put(('bundle', sender, bundle)))
+        finish = [values for values in commands if values[0] == b'fin']
+        if finish:
+            depth = max(depth, self.put(('finish', sender, [(address, values) for values in finish])))
+        return depth
+        
+    def put(self, item):
+        try:
+            self.queue.put(item, timeout = command_queue_timeout)
+        except queue.Full:
+            if self.error is None:
+                self.error = "command queue stayed full for {:.0f}s".format(command_queue_timeout)
+        return self.queue.qsize()
+        
+    # Wait until everything queued so far has been sent
+    def flush(self):
+        self.queue.join()
+        
+    # The None only wakes a worker waiting on an empty queue; a full queue means it's busy and will see stopped next
+    def stop(self):
+        self.stopped = True
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.thread.join(timeout = command_queue_timeout)
+        
+    # Start sending again after an error, once whatever was queued before it has been dropped
+    def reset(self):
+        self.flush()
+        self.error = None
+        
+    # Items are sent in queue order, so when a fin comes up every bundle of its frame has been written unless error is set
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None or self.stopped:
+                    return
+                kind, sender, messages = item
+                if self.error is not None:
+                    continue
+                if log_osc_commands:
+                    for address, values in messages:
+                        print("OSC send" , address, "{}".format(values))
+                if kind == 'finish':
+                    for address, values in messages:
+                        sender.send_message(address, values)
+                else:
+                    sender.send_bundle(messages)
+            except Exception as error:
+                self.error = "sending {} commands failed: {}".format(len(messages), error)
+                print("COMMAND SEND FAILED: ", self.error)
+            finally:
+                self.queue.task_done()
+
+
+# OSC transport, started on first execute and torn down on unregister so that the addon can be reloaded
+def startOSC():
+    global osc_receiver, osc_sender, commandSender
+    if osc_receiver is None:
+        osc_receiver = OSCThreadServer()
+        osc_receiver.listen(address=ip_in, port=port_in, default=True)
+        osc_receiver.bind(b'/finished', functools.partial(callback, port_in))
+        osc_receiver.bind(b'/startup', functools.partial(startupCallback, port_in))
+    if osc_sender is None:
+        osc_sender = OSCClient(ip_out, port_out)
+    if commandSender is None:
+        commandSender = CommandSender()
+        
+# Listen for an additional machine's relay on its own reply port, so that its /finished can be told apart
+def listenOSC(port):
+    if osc_receiver is None or port == port_in or port in osc_listen_sockets:
+        return
+    sock = osc_receiver.listen(address=ip_in, port=port)
+    osc_receiver.bind(b'/finished', functools.partial(callback, port), sock=sock)
+    osc_receiver.bind(b'/startup', functools.partial(startupCallback, port), sock=sock)
+    osc_listen_sockets[port] = sock
+
+def stopOSC():
+    global osc_receiver, osc_sender, commandSender
+    if commandSender is not None:
+        commandSender.stop()
+        commandSender = None
+    if osc_receiver is not None:
+        osc_receiver.stop_all()
+        osc_receiver.terminate_server()
+        osc_receiver.join_server()
+        osc_receiver = None
+    osc_listen_sockets.clear()
+    osc_sender = None
+    
+
+# Collections are created the first time they are needed rather than when the module is loaded
+def getCollection(name):
+    collection = bpy.data.collections.get(name)
+    if collection is None:
+        collection = bpy.data.collections.new(name)
+        bpy.context.scene.collection.children.link(collection)
+    return collection
+
+
+classes = (PaintingMachineSettings, View3dPanel, ExecutePainting, ResumePainting, CancelExecution, AddPaintingMachine, RemovePaintingMachine, BenchmarkPathPreview)
+    
+# Register. Safe to call again while already registered.
 def register():
-    bpy.utils.register_class(View3dPanel)
-    bpy.utils.register_class(ExecutePainting)
-    bpy.utils.register_class(CancelExecution)
+    startTime = time.perf_counter()
+    for cls in classes:
+        if not cls.is_registered:
+            bpy.utils.register_class(cls)
+    for name, prop in sceneProperties().items():
+        setattr(bpy.types.Scene, name, prop)
+    if previewLoadPost not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(previewLoadPost)
+    bpy.app.timers.register(previewLoadPost, first_interval = 0.0)
+    print("Light Painting Path Export Tool registered in {:.1f} ms ({:.1f} ms since module load)".format((time.perf_counter() - startTime) * 1000, (time.perf_counter() - moduleLoadTime) * 1000))
     
 # Unregister
 def unregister():
-    bpy.utils.unregister_class(View3dPanel)
-    bpy.utils.unregister_class(ExecutePainting)
-    bpy.utils.unregister_class(CancelExecution)
+    startTime = time.perf_counter()
+    stopCompileJob()
+    stopOSC()
+    stopPathPreview()
+    setPathBevels(True)
+    if previewLoadPost in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(previewLoadPost)
+    if bpy.app.timers.is_registered(previewLoadPost):
+        bpy.app.timers.unregister(previewLoadPost)
+    for cls in reversed(classes):
+        if cls.is_registered:
+            bpy.utils.unregister_class(cls)
+    for name in sceneProperties():
+        if hasattr(bpy.types.Scene, name):
+            delattr(bpy.types.Scene, name)
+    print("Light Painting Path Export Tool unregistered in {:.1f} ms".format((time.perf_counter() - startTime) * 1000))
     
     
 # Needed to run script in Text Editor
@@ -15,12 +15,26 @@ import bpy
 import bmesh
 from bpy.types import Panel, Operator
 from mathutils import Vector
+import time
+
+moduleLoadTime = time.perf_counter()
 
 finishClicked = False
 cancelClicked = False
 buildingPath = False
 undoClicked = False
 
+lightPathsCollection = None
+lightPathPointsCollection = None
+
+
+def getCollection(name):
+    collection = bpy.data.collections.get(name)
+    if collection is None:
+        collection = bpy.data.collections.new(name)
+        bpy.context.scene.collection.children.link(collection)
+    return collection
+
 
 # Enter build path mode operator
 class BuildPathOperator(Operator):
@@ -32,21 +46,15 @@ class BuildPathOperator(Operator):
     vertexList = []
     emptyList = []
     
+    selectionTimer = None   # event timer that checks the selection once a click has been handled
+    eventTimes = {}         # event type -> [count, total seconds, max seconds] spent in modal
+    
     
-    # Set up collections
-    global lightPathsCollection
-    global lightPathPointsCollection
-    if "Light Paths" not in bpy.data.collections:
-        lightPathsCollection = bpy.data.collections.new("Light Paths")
-        bpy.context.scene.collection.children.link(lightPathsCollection)
-    else:
-        lightPathsCollection = bpy.data.collections["Light Paths"]
-        
-    if "Light Path Points" not in bpy.data.collections:
-        lightPathPointsCollection = bpy.data.collections.new("Light Path Points")
-        bpy.context.scene.collection.children.link(lightPathPointsCollection)
-    else:
-        lightPathPointsCollection = bpy.data.collections["Light Path Points"]
+    # Set up collections on first use
+    def initializeCollections(self):
+        global lightPathsCollection, lightPathPointsCollection
+        lightPathsCollection = getCollection("Light Paths")
+        lightPathPointsCollection = getCollection("Light Path Points")
     
     
     # Enter object mode and store the selected mesh for later recall
@@ -224,13 +232,48 @@ class BuildPathOperator(Operator):
         
     # The path build was finished or canceled, clean up some lists
     def pathDrawDone(self):
+        if self.selectionTimer is not None:
+            bpy.context.window_manager.event_timer_remove(self.selectionTimer)
+            self.selectionTimer = None
         del self.vertexList[:]
         del self.emptyList[:]
         del self.pathCurve
         
-    
+        
+    # Add the newest selected vertex to the path. Only called once a click has been handled, so that the select operator
+    # has already updated select_history, and the bmesh is only wrapped if anything is selected at all.
+    def checkSelection(self):
+        me = bpy.context.object.data
+        if me.total_vert_sel == 0:
+            return
+        bm = bmesh.from_edit_mesh(me)
+        if bm.select_history:
+            elem = bm.select_history[-1]
+            if isinstance(elem, bmesh.types.BMVert):
+                if not (len(self.vertexList) > 0 and self.vertexList[-1] == elem.index):
+                    self.vertexSelected(elem)
+                    
+                    
+    # Time spent handling each event type, printed when the path build ends
+    def printEventTimes(self):
+        for eventType, (count, total, longest) in sorted(self.eventTimes.items(), key = lambda item: -item[1][1]):
+            print("{}: {} events, {:.1f} us average, {:.1f} us max".format(eventType, count, total / count * 1e6, longest * 1e6))
+        
+        
     # Modal is called while the path build is active
     def modal(self, context, event):
+        startTime = time.perf_counter()
+        result = self.handleEvent(context, event)
+        elapsed = time.perf_counter() - startTime
+        count, total, longest = self.eventTimes.get(event.type, (0, 0.0, 0.0))
+        self.eventTimes[event.type] = [count + 1, total + elapsed, max(longest, elapsed)]
+        if result != {'PASS_THROUGH'}:
+            print("Modal handler time per event:")
+            self.printEventTimes()
+        return result
+        
+        
+    def handleEvent(self, context, event):
         global finishClicked, cancelClicked, undoClicked, buildingPath
         
         if not (bpy.context.object.mode == 'EDIT'):
@@ -262,15 +305,14 @@ class BuildPathOperator(Operator):
             self.undoPath()
             print("UNDO")
         
-        if event.type == 'LEFTMOUSE' or event.type == "MOUSEMOVE": #butchering this just to make the race condition work; bm.select_history isn't updated yet when we reach the left mouse click event here
-            ob = bpy.context.object
-            me = ob.data
-            bm = bmesh.from_edit_mesh(me)
-            if bm.select_history:
-                elem = bm.select_history[-1]
-                if isinstance(elem, bmesh.types.BMVert):
-                    if not (len(self.vertexList) > 0 and self.vertexList[-1] == elem.index):
-                        self.vertexSelected(elem)
+        # bm.select_history isn't updated yet when we reach the left mouse click event here, since the select operator
+        # handles the click after us. Check the selection on the next timer event instead, after the click has been handled.
+        if event.type == 'LEFTMOUSE' and self.selectionTimer is None:
+            self.selectionTimer = context.window_manager.event_timer_add(0.01, window = context.window)
+        elif event.type == 'TIMER' and self.selectionTimer is not None:
+            context.window_manager.event_timer_remove(self.selectionTimer)
+            self.selectionTimer = None
+            self.checkSelection()
                 
         return {'PASS_THROUGH'}
 
@@ -284,7 +326,10 @@ class BuildPathOperator(Operator):
         self.pathCurve = None
         self.vertexList = []
         self.emptyList = []
+        self.selectionTimer = None
+        self.eventTimes = {}
         
+        self.initializeCollections()
         lightPathsCollection.hide_viewport  = False
         lightPathPointsCollection.hide_viewport  = False
         
@@ -369,21 +414,23 @@ class View3dPanel(Panel):
         
         
     
-# Register
+classes = (View3dPanel, BuildPathOperator, FinishPathOperator, CancelPathOperator, UndoPathOperator)
+    
+# Register. Safe to call again while already registered.
 def register():
-    bpy.utils.register_class(View3dPanel)
-    bpy.utils.register_class(BuildPathOperator)
-    bpy.utils.register_class(FinishPathOperator)
-    bpy.utils.register_class(CancelPathOperator)
-    bpy.utils.register_class(UndoPathOperator)
+    startTime = time.perf_counter()
+    for cls in classes:
+        if not cls.is_registered:
+            bpy.utils.register_class(cls)
+    print("Adorn Mesh Vertices With Path Tool registered in {:.1f} ms ({:.1f} ms since module load)".format((time.perf_counter() - startTime) * 1000, (time.perf_counter() - moduleLoadTime) * 1000))
     
 # Unregister
 def unregister():
-    bpy.utils.unregister_class(View3dPanel)
-    bpy.utils.unregister_class(BuildPathOperator)
-    bpy.utils.unregister_class(FinishPathOperator)
-    bpy.utils.unregister_class(CancelPathOperator)
-    bpy.utils.unregister_class(UndoPathOperator)
+    startTime = time.perf_counter()
+    for cls in reversed(classes):
+        if cls.is_registered:
+            bpy.utils.unregister_class(cls)
+    print("Adorn Mesh Vertices With Path Tool unregistered in {:.1f} ms".format((time.perf_counter() - startTime) * 1000))
     
     
 # Needed to run script in Text Editor